@@ -0,0 +1,236 @@
+import contextlib
+import io
+import random
+import sys
+import time
+import tracemalloc
+
+import keymap
+import keytrace
+from host_sim import HostBackend, Simulator
+from matrix import MatrixScanner
+
+# Host-side benchmarks, run with `python3 bench.py`. Numbers are for CPython
+# on the host simulator, so compare them against each other rather than
+# against the board.
+#
+# The workloads run the real keymap through the simulator (virtual clock,
+# recording HID devices) one scan per simulated millisecond and report:
+#   scans/s        wall-clock scan rate
+#   cpu us/scan    process time per scan
+#   alloc B/scan   bytes allocated and freed again within a scan (tracemalloc
+#                  peak over the scan's starting point), what feeds the GC
+#   reports/key    HID reports sent per key press in the workload
+
+# keymap (row, col) of plain letter keys on the base layer
+LETTERS = {
+    "left": [(1, 2), (1, 3), (1, 4), (1, 5), (1, 6), (2, 2), (2, 3), (2, 4)]
+    + [(2, 5), (2, 6), (3, 2), (3, 3), (3, 4), (3, 5), (3, 6)],
+    "right": [(1, 2), (1, 3), (1, 4), (1, 5), (1, 6), (2, 3), (2, 4), (2, 5)]
+    + [(2, 6), (3, 3), (3, 4), (3, 5), (3, 6)],
+}
+MOD_TAPS = [("left", (2, 1)), ("left", (4, 6))]
+
+
+def legacy_scan(row_pins, col_pins, row_pin_map, col_pin_map, state, prev_state, flips):
+    # the right-half matrix read as code.py used to do it, kept for comparison
+    idx = 0
+    for row, (row_idx, row_name) in zip(row_pins, row_pin_map.items()):
+        row.value = False
+        for col, (col_idx, col_name) in zip(col_pins, col_pin_map.items()):
+            prev_state_val_right = state["right"][idx]
+            prev_state["right"][idx] = prev_state_val_right
+            cur_state_val_right = not col.value
+            state["right"][idx] = cur_state_val_right
+            if cur_state_val_right and not prev_state_val_right:
+                flips["right"].add(idx)
+            idx += 1
+        row.value = True
+
+
+def scans_per_second(fn, seconds=1.0):
+    n = 0
+    start = time.perf_counter()
+    end = start + seconds
+    while True:
+        for _ in range(100):
+            fn()
+        n += 100
+        now = time.perf_counter()
+        if now >= end:
+            return n / (now - start)
+
+
+def bench_matrix(seconds=1.0):
+    backend = HostBackend()
+    col_pins = [backend.input_pin(p) for p in keymap.col_pin_map.values()]
+    row_pins = [backend.output_pin(p) for p in keymap.row_pin_map.values()]
+    backend.matrix.pressed = {(0, 1), (2, 3)}
+    n_keys = len(row_pins) * len(col_pins)
+
+    state = {"right": [False] * n_keys}
+    prev_state = {"right": [False] * n_keys}
+
+    def before():
+        flips = {"left": set(), "right": set()}
+        legacy_scan(
+            row_pins,
+            col_pins,
+            keymap.row_pin_map,
+            keymap.col_pin_map,
+            state,
+            prev_state,
+            flips,
+        )
+
+    scanner = MatrixScanner(row_pins, col_pins)
+    return scans_per_second(before, seconds), scans_per_second(scanner.scan, seconds)
+
+
+def bench_loop(seconds=1.0, matrix_backend="digitalio"):
+    sim = Simulator(matrix_backend=matrix_backend)
+    sim.set_keys()
+    return scans_per_second(sim.step, seconds)
+
+
+def timeline(events, length):
+    # events: (start ms, end ms, side, (row, col)) -> one frame per ms
+    frames = []
+    for t in range(length):
+        down = {"left": [], "right": []}
+        for start, end, side, key in events:
+            if start <= t < end:
+                down[side].append(key)
+        frames.append((0.001, down["left"], down["right"]))
+    return frames
+
+
+def idle_workload():
+    return timeline([], 2000), 0
+
+
+def typing_workload(n=150, gap=35, hold=45):
+    # both halves, each key held a little past the next press (rolls)
+    rng = random.Random(0)
+    events = []
+    for i in range(n):
+        side = rng.choice(("left", "right"))
+        events.append((i * gap, i * gap + hold, side, rng.choice(LETTERS[side])))
+    return timeline(events, n * gap + 300), n
+
+
+def tap_hold_roll_workload(n=60, gap=80):
+    # mod-tap down, letter down, mod-tap up, letter up, all inside T
+    rng = random.Random(1)
+    events = []
+    for i in range(n):
+        t = i * gap
+        side, mod_tap = MOD_TAPS[i % len(MOD_TAPS)]
+        events.append((t, t + 40, side, mod_tap))
+        events.append((t + 20, t + 60, "right", rng.choice(LETTERS["right"])))
+    return timeline(events, n * gap + 300), 2 * n
+
+
+def mouse_workload(hold=1000):
+    # nav layer, hold mouse up and left together
+    events = [
+        (0, hold + 20, "left", (4, 5)),
+        (10, hold, "left", (1, 4)),
+        (10, hold, "left", (2, 3)),
+    ]
+    return timeline(events, hold + 200), 3
+
+
+def mash_workload(rounds=5, hold=200):
+    everything = [(r, c) for r in range(1, 5) for c in range(1, 7)]
+    events = []
+    for i in range(rounds):
+        t = i * (hold + 100)
+        for side in ("left", "right"):
+            for key in everything:
+                events.append((t, t + hold, side, key))
+    return timeline(events, rounds * (hold + 100)), rounds * 2 * len(everything)
+
+
+WORKLOADS = [
+    ("idle", idle_workload),
+    ("typing", typing_workload),
+    ("tap-hold rolls", tap_hold_roll_workload),
+    ("mouse keys", mouse_workload),
+    ("mash", mash_workload),
+]
+
+
+def run_workload(frames, presses):
+    sim = Simulator()
+    wall = cpu = 0
+    transient = 0
+    tracemalloc.start()
+    # keys report overflows with print(), keep that out of the table
+    with contextlib.redirect_stdout(io.StringIO()):
+        for dt, left, right in frames:
+            sim.set_keys(left, right)
+            sim.backend.clock.advance(dt)
+            sim.left.step()
+            before, _ = tracemalloc.get_traced_memory()
+            tracemalloc.reset_peak()
+            start_wall = time.perf_counter_ns()
+            start_cpu = time.process_time_ns()
+            sim.fw.scan()
+            cpu += time.process_time_ns() - start_cpu
+            wall += time.perf_counter_ns() - start_wall
+            _, peak = tracemalloc.get_traced_memory()
+            transient += peak - before
+    tracemalloc.stop()
+    n = len(frames)
+    reports = (
+        len(sim.keyboard.reports) + len(sim.mouse.reports) + len(sim.concon.reports)
+    )
+    return {
+        "scans/s": n / (wall / 1e9),
+        "cpu us/scan": cpu / n / 1000,
+        "alloc B/scan": transient / n,
+        "reports/key": reports / presses if presses else 0.0,
+    }
+
+
+def bench_workloads():
+    columns = ["scans/s", "cpu us/scan", "alloc B/scan", "reports/key"]
+    print("%-15s" % "workload" + "".join("%14s" % c for c in columns))
+    for name, make in WORKLOADS:
+        frames, presses = make()
+        result = run_workload(frames, presses)
+        print("%-15s" % name + "".join("%14.1f" % result[c] for c in columns))
+
+
+def bench_trace(path):
+    # a trace recorded on the board (keymap.trace_size), replayed as fast as
+    # the host goes
+    entries = keytrace.load(path)
+    sim = Simulator()
+    start_scans = sim.fw.counter
+    start = time.perf_counter()
+    sim.fw.replay(entries)
+    elapsed = time.perf_counter() - start
+    scans = sim.fw.counter - start_scans
+    presses = max(sum(down for _, _, _, down in entries), 1)
+    reports = len(sim.keyboard.reports)
+    print(
+        "%s: %d edges, %d scans, %.0f scans/s, %.1f reports/key"
+        % (path, len(entries), scans, scans / elapsed, reports / presses)
+    )
+
+
+if __name__ == "__main__":
+    before, after = bench_matrix()
+    print("matrix scan  before %8.0f/s  after %8.0f/s  (%.2fx)" % (before, after, after / before))
+    for matrix_backend in ("digitalio", "keypad"):
+        print(
+            "full loop    %8.0f scans/s  (%s)"
+            % (bench_loop(matrix_backend=matrix_backend), matrix_backend)
+        )
+    print()
+    bench_workloads()
+    for path in sys.argv[1:]:
+        print()
+        bench_trace(path)
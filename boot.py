@@ -0,0 +1,75 @@
+import storage
+import usb_hid
+
+# Runs before code.py, at power-up only: sets up the USB HID devices. Next to
+# the standard keyboard, mouse and consumer control there's an n-key
+# rollover keyboard whose report is a bitmap, one bit per key, so any number
+# of keys can be down at once (hid_output.NkroReport); keymap.nkro picks
+# which keyboard code.py types on.
+#
+# No boot-protocol device: CircuitPython only allows one as USB interface 0,
+# ahead of the serial console and the CIRCUITPY drive, so both would have to
+# be turned off, and with them the console the "s"/"t" commands use. A BIOS
+# that only speaks the boot protocol may not see the keyboard.
+
+# "t" on the serial console saves the key trace (keymap.trace_size) to
+# CIRCUITPY, which code.py can only write once it's remounted here. The host
+# can't write to the drive while it is, so to copy files over again turn
+# this back off from the REPL, e.g. rename /boot.py and reset.
+WRITABLE = False
+
+if WRITABLE:
+    storage.remount("/", readonly=False)
+
+NKRO_REPORT_ID = 4  # after the standard devices' 1, 2 and 3
+
+NKRO_DESCRIPTOR = bytes(
+    (
+        0x05, 0x01,  # usage page (generic desktop)
+        0x09, 0x06,  # usage (keyboard)
+        0xA1, 0x01,  # collection (application)
+        0x85, NKRO_REPORT_ID,  # report id
+        # modifiers, one bit each
+        0x05, 0x07,  # usage page (keyboard)
+        0x19, 0xE0,  # usage minimum (left control)
+        0x29, 0xE7,  # usage maximum (right gui)
+        0x15, 0x00,  # logical minimum (0)
+        0x25, 0x01,  # logical maximum (1)
+        0x75, 0x01,  # report size (1)
+        0x95, 0x08,  # report count (8)
+        0x81, 0x02,  # input (data, variable, absolute)
+        # every other keycode, one bit each
+        0x19, 0x00,  # usage minimum (0)
+        0x29, 0xDF,  # usage maximum (0xdf)
+        0x95, 0xE0,  # report count (224)
+        0x81, 0x02,  # input (data, variable, absolute)
+        # caps lock etc. LEDs, so the host has somewhere to send them
+        0x05, 0x08,  # usage page (LEDs)
+        0x19, 0x01,  # usage minimum (num lock)
+        0x29, 0x05,  # usage maximum (kana)
+        0x95, 0x05,  # report count (5)
+        0x91, 0x02,  # output (data, variable, absolute)
+        0x75, 0x03,  # report size (3)
+        0x95, 0x01,  # report count (1)
+        0x91, 0x01,  # output (constant), padding
+        0xC0,  # end collection
+    )
+)
+
+nkro_keyboard = usb_hid.Device(
+    report_descriptor=NKRO_DESCRIPTOR,
+    usage_page=0x01,
+    usage=0x06,
+    report_ids=(NKRO_REPORT_ID,),
+    in_report_lengths=(29,),  # hid_output.NKRO_REPORT_LENGTH
+    out_report_lengths=(1,),
+)
+
+usb_hid.enable(
+    (
+        usb_hid.Device.KEYBOARD,
+        usb_hid.Device.MOUSE,
+        usb_hid.Device.CONSUMER_CONTROL,
+        nkro_keyboard,
+    )
+)
@@ -0,0 +1,177 @@
+# Combos: several keys pressed within a short window acting as one key.
+# Each combo gets a virtual key slot on the right half past the matrix keys
+# (slot n_keys + combo number), so its action goes through layers, tap-hold
+# and the state machines like any other key; this only decides when that
+# virtual key is down and hides the physical keys it used.
+#
+# Matching goes by precomputed bitmasks: per physical key, a mask of the
+# combos it's in (combo i is bit i). With no combo key going down and
+# nothing in progress a scan costs a couple of ANDs however many combos
+# there are.
+#
+# A combo key going down is held back until either the keys held back make
+# up a whole combo (it fires, unless a bigger combo could still complete),
+# or they can't become one any more: the window runs out, another key goes
+# down, or one of them comes back up. Then they're let through as they
+# were, a key that already came up staying down for one scan so its tap
+# isn't lost. A fired combo stays down until any of its keys goes up; its
+# other keys stay hidden until they go up too.
+
+
+class Combo:
+    def __init__(self, keys, action):
+        # keys: (side, row, col) in keymap terms; action: a keymap entry, or
+        # {layer name: keymap entry} for different actions per layer
+        self.keys = keys
+        self.action = action
+
+
+class ComboEngine:
+    def __init__(self, masks, n_keys, term_ms=50):
+        # masks: (left key mask, right key mask) per combo
+        self.masks = masks
+        self.n_keys = n_keys
+        self.term = int(term_ms * 1000000)
+        self.combo_keys = {"left": 0, "right": 0}
+        self.candidates = {"left": {}, "right": {}}  # key bit -> combo bits
+        for i, (left, right) in enumerate(masks):
+            for side, mask in (("left", left), ("right", right)):
+                self.combo_keys[side] |= mask
+                for idx in range(n_keys):
+                    bit = 1 << idx
+                    if mask & bit:
+                        candidates = self.candidates[side]
+                        candidates[bit] = candidates.get(bit, 0) | (1 << i)
+        self.combo_bit = {1 << i: i for i in range(len(masks))}
+
+        self.prev = {"left": 0, "right": 0}
+        self.pending = {"left": 0, "right": 0}  # held back
+        self.pending_since = 0
+        self.possible = 0  # combos the pending keys could still make
+        self.consumed = {"left": 0, "right": 0}  # used by fired combos
+        self.late = {"left": 0, "right": 0}  # up already, shown for a scan
+        self.fired = 0  # combos down
+        self.bits = {"left": 0, "right": 0}  # what the rest of the loop sees
+
+    def exact(self):
+        # the combo the pending keys make on their own, -1 if none, and
+        # whether a bigger one could still complete
+        pending = self.pending
+        match = -1
+        bigger = False
+        possible = self.possible
+        while possible:
+            bit = possible & -possible
+            possible ^= bit
+            i = self.combo_bit[bit]
+            left, right = self.masks[i]
+            if left == pending["left"] and right == pending["right"]:
+                match = i
+            else:
+                bigger = True
+        return match, bigger
+
+    def fire(self, i):
+        pending = self.pending
+        consumed = self.consumed
+        consumed["left"] |= pending["left"]
+        consumed["right"] |= pending["right"]
+        pending["left"] = pending["right"] = 0
+        self.possible = 0
+        self.fired |= 1 << i
+
+    def flush(self, keys):
+        # lets the pending keys through, keeping ones already up for a scan
+        pending = self.pending
+        late = self.late
+        late["left"] |= pending["left"] & ~keys["left"]
+        late["right"] |= pending["right"] & ~keys["right"]
+        pending["left"] = pending["right"] = 0
+        self.possible = 0
+
+    def settle(self, keys):
+        # fires the pending combo if there's one, lets the keys through if not
+        match, _ = self.exact()
+        if match >= 0:
+            self.fire(match)
+        else:
+            self.flush(keys)
+
+    def add(self, side, new, keys, now):
+        # combo keys that went down this scan
+        candidates = self.candidates[side]
+        pending = self.pending
+        while new:
+            bit = new & -new
+            new ^= bit
+            combos = candidates[bit]
+            if pending["left"] | pending["right"] and not self.possible & combos:
+                # can't join what's pending, which has to be decided first
+                self.settle(keys)
+            if pending["left"] | pending["right"]:
+                self.possible &= combos
+            else:
+                self.pending_since = now
+                self.possible = combos
+            pending[side] |= bit
+            match, bigger = self.exact()
+            if match >= 0 and not bigger:
+                self.fire(match)
+
+    def update(self, keys, now):
+        # keys: debounced key bitmask per side -> self.bits
+        prev = self.prev
+        pending = self.pending
+        consumed = self.consumed
+        late = self.late
+        left = keys["left"]
+        right = keys["right"]
+        pressed_left = left & ~prev["left"]
+        pressed_right = right & ~prev["right"]
+        prev["left"] = left
+        prev["right"] = right
+        late["left"] = late["right"] = 0
+        bits = self.bits
+
+        combo_left = pressed_left & self.combo_keys["left"]
+        combo_right = pressed_right & self.combo_keys["right"]
+        busy = pending["left"] | pending["right"] | consumed["left"] | consumed["right"]
+        if not (busy or self.fired or combo_left or combo_right):
+            bits["left"] = left
+            bits["right"] = right
+            return bits
+
+        if self.fired:
+            # a combo goes up with the first of its keys
+            fired = self.fired
+            while fired:
+                bit = fired & -fired
+                fired ^= bit
+                mask_left, mask_right = self.masks[self.combo_bit[bit]]
+                if mask_left & ~left or mask_right & ~right:
+                    self.fired ^= bit
+        consumed["left"] &= left
+        consumed["right"] &= right
+
+        if pending["left"] | pending["right"]:
+            if pending["left"] & ~left or pending["right"] & ~right:
+                self.settle(keys)
+            elif (pressed_left & ~self.combo_keys["left"]) or (
+                pressed_right & ~self.combo_keys["right"]
+            ):
+                self.settle(keys)
+            elif now - self.pending_since > self.term:
+                self.settle(keys)
+
+        if combo_left:
+            self.add("left", combo_left, keys, now)
+        if combo_right:
+            self.add("right", combo_right, keys, now)
+
+        bits["left"] = (left & ~pending["left"] & ~consumed["left"]) | late["left"]
+        bits["right"] = (
+            (right & ~pending["right"] & ~consumed["right"])
+            | late["right"]
+            | (self.fired << self.n_keys)
+        )
+        return bits
@@ -0,0 +1,89 @@
+from array import array
+
+# Debouncing between the matrix read and the key state the rest of the loop
+# sees. Works on the per-half key bitmasks; per-key timestamps are kept as
+# 16-bit wrapping milliseconds in an array, and which keys are locked out or
+# waiting is a bitmask, so an idle matrix costs a couple of int compares.
+#
+#   eager      report a change at once, then ignore that key for window_ms
+#   defer      report a change once the key has been stable for window_ms
+#   symmetric  report all changes once the whole half has been stable for
+#              window_ms (one timer for everything)
+
+ALGORITHMS = ("eager", "defer", "symmetric")
+
+
+class Debouncer:
+    def __init__(self, n_keys, algorithm="eager", window_ms=5):
+        if algorithm not in ALGORITHMS:
+            raise ValueError(f"unknown debounce algorithm {algorithm}")
+        self.algorithm = algorithm
+        self.window = window_ms
+        self.bits = 0  # debounced state
+        self.busy = 0  # eager: locked out keys, defer: keys waiting to settle
+        self.stamps = array("H", [0] * n_keys)
+        self.bit_index = {1 << idx: idx for idx in range(n_keys)}
+        self.raw = 0
+        self.raw_since = 0
+
+    def update(self, raw, now):
+        # raw key bitmask and scan time in ns -> debounced key bitmask
+        now_ms = (now // 1000000) & 0xFFFF
+        if self.algorithm == "eager":
+            self._eager(raw, now_ms)
+        elif self.algorithm == "defer":
+            self._defer(raw, now_ms)
+        else:
+            self._symmetric(raw, now_ms)
+        return self.bits
+
+    def _expired(self, now_ms):
+        # keys in busy whose window has run out
+        stamps = self.stamps
+        bit_index = self.bit_index
+        window = self.window
+        done = 0
+        pending = self.busy
+        while pending:
+            bit = pending & -pending
+            pending ^= bit
+            if (now_ms - stamps[bit_index[bit]]) & 0xFFFF >= window:
+                done |= bit
+        return done
+
+    def _stamp(self, keys, now_ms):
+        stamps = self.stamps
+        bit_index = self.bit_index
+        while keys:
+            bit = keys & -keys
+            keys ^= bit
+            stamps[bit_index[bit]] = now_ms
+
+    def _eager(self, raw, now_ms):
+        if self.busy:
+            self.busy &= ~self._expired(now_ms)
+        changed = (raw ^ self.bits) & ~self.busy
+        if changed:
+            self.bits ^= changed
+            self.busy |= changed
+            self._stamp(changed, now_ms)
+
+    def _defer(self, raw, now_ms):
+        diff = raw ^ self.bits
+        # keys that bounced back to their debounced value stop waiting
+        self.busy &= diff
+        new = diff & ~self.busy
+        if new:
+            self.busy |= new
+            self._stamp(new, now_ms)
+        if self.busy:
+            settled = self._expired(now_ms)
+            self.bits ^= settled
+            self.busy &= ~settled
+
+    def _symmetric(self, raw, now_ms):
+        if raw != self.raw:
+            self.raw = raw
+            self.raw_since = now_ms
+        elif raw != self.bits and (now_ms - self.raw_since) & 0xFFFF >= self.window:
+            self.bits = raw
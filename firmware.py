@@ -0,0 +1,640 @@
+import gc
+
+import split_link
+from matrix import MatrixScanner, KeypadScanner
+from layers import LayerEngine, layer_key_target
+from timers import Timers
+from macros import MacroPlayer
+from debounce import Debouncer
+import stats as scan_stats
+import keytrace
+import keys
+from gc_policy import GCPolicy
+from tap_hold import TapHoldResolver
+from combos import ComboEngine
+from mouse_keys import MouseKeys
+
+# The right-half scan loop: read the left half over the UART, scan the right
+# matrix, pick the active layer and tick the key state machines. Everything
+# hardware-facing goes through a backend (see hal.py / host_sim.py).
+#
+# Nothing on the per-scan path allocates apart from the clock sample (a long
+# int on the board): state lives in ints, preallocated buffers and the
+# constant tuples below. Key edges still allocate a little (HID calls with
+# *args, timer entries), which the GC policy collects between bursts.
+
+SIDES = ("left", "right")
+OTHER = {"left": "right", "right": "left"}
+
+
+class Firmware:
+    def __init__(
+        self,
+        backend,
+        layers_dict,
+        row_pin_map,
+        col_pin_map,
+        uart_pins,
+        tri_layers=(),
+        layer_priorities=None,
+        debounce=None,
+        debounce_ms=5,
+        debounce_left=True,
+        matrix_backend="digitalio",
+        latency_stats=False,
+        target_scan_ms=2,
+        trace_size=0,
+        trace_file="/trace.txt",
+        compiled=None,
+        gc_idle_ms=None,
+        gc_min_free=16384,
+        tap_hold_policy="hold_on_other_key_press",
+        retro_tap=False,
+        combos=(),
+        combo_term_ms=50,
+        mouse_start_speed=200,
+        mouse_max_speed=1600,
+        mouse_time_to_max_ms=800,
+        mouse_curve=2,
+        mouse_scroll_speed=15,
+        mouse_report_ms=10,
+    ):
+        self.backend = backend
+
+        self.uart = backend.uart(
+            uart_pins[0], uart_pins[1], baudrate=115200, receiver_buffer_size=256
+        )
+
+        self.row_pin_map = row_pin_map
+        self.col_pin_map = col_pin_map
+        if matrix_backend == "keypad":
+            self.scanner = KeypadScanner(
+                backend.key_matrix(
+                    list(row_pin_map.values()), list(col_pin_map.values())
+                ),
+                backend.key_event(),
+            )
+        elif matrix_backend == "digitalio":
+            self.col_pins = [backend.input_pin(pin) for pin in col_pin_map.values()]
+            self.row_pins = [backend.output_pin(pin) for pin in row_pin_map.values()]
+            self.scanner = MatrixScanner(self.row_pins, self.col_pins)
+        else:
+            raise ValueError(f"unknown matrix backend {matrix_backend}")
+        self.n_keys = self.scanner.n_keys
+        self.key_mask = (1 << self.n_keys) - 1
+
+        # debounce algorithm (see debounce.py) or None, the left half can be
+        # debounced here or on the left board itself
+        self.debouncers = {"right": None, "left": None}
+        if debounce is not None:
+            self.debouncers["right"] = Debouncer(self.n_keys, debounce, debounce_ms)
+            if debounce_left:
+                self.debouncers["left"] = Debouncer(self.n_keys, debounce, debounce_ms)
+
+        self.layers_dict = layers_dict
+        self.layer_info = {"left": {}, "right": {}}
+
+        # key state per half as bitmasks, bit idx set while key idx is down,
+        # plus the keys that went down / up this scan. matrix is what the
+        # (debounced) matrix reads, physical the same after combos, state
+        # what the machines have been given so far; physical and state only
+        # differ while edges queue behind an undecided tap-hold
+        self.matrix = {"right": 0, "left": 0}
+        self.physical = {"right": 0, "left": 0}
+        self.state = {"right": 0, "left": 0}
+        self.pressed = {"right": 0, "left": 0}
+        self.released = {"right": 0, "left": 0}
+
+        # keymap: layers_dict, or a module written by keymap_compiler.py that
+        # has it already flattened. Combos (combos.py) take key slots after
+        # the right half's keys
+        if compiled is not None:
+            layer_names, layer_keys, combo_masks = self.load_compiled(compiled)
+        else:
+            layer_names, layer_keys, combo_masks = self.flatten_layers(
+                layers_dict, combos
+            )
+        self.n_slots = self.n_keys + len(combo_masks)
+        if self.n_slots > keytrace.INDEX + 1:
+            raise ValueError("too many combos")
+        self.combos = None
+        if combo_masks:
+            self.combos = ComboEngine(combo_masks, self.n_keys, combo_term_ms)
+        base_layer = self.layers["base"]
+        self.final = {
+            "right": list(base_layer["right"]),
+            "left": list(base_layer["left"]),
+        }
+        for side, idx, val in layer_keys:
+            self.layer_info[side][val] = idx
+
+        self.layer_engine = LayerEngine(
+            layer_names, layer_keys, tri_layers, layer_priorities
+        )
+
+        # keys whose machines need ticking: pressed, or not back in start yet
+        self.active = {"right": 0, "left": 0}
+        # plain keys (no state machine) that are down, see keys.Key
+        self.plain_down = {"right": 0, "left": 0}
+        # tap-hold keys waiting to be decided, and the edges queued behind
+        # them (tap_hold.py)
+        self.undecided = {"right": 0, "left": 0}
+        self.tap_hold = TapHoldResolver(self.n_slots, tap_hold_policy, retro_tap)
+        # keys that are a tap-hold on some layer, and the other keys held
+        # back behind one that went down in the same scan
+        self.tap_hold_keys = {"right": 0, "left": 0}
+        for layer in self.layers.values():
+            for side, side_keys in layer.items():
+                for idx, key in enumerate(side_keys):
+                    if hasattr(key, "sm") and key.type in ("modtap", "tapdance"):
+                        self.tap_hold_keys[side] |= 1 << idx
+        self.held_back = {"right": 0, "left": 0}
+        self.bit_index = {1 << idx: idx for idx in range(self.n_slots)}
+
+        # tap-hold waits park on a deadline instead of being polled
+        self.timers = Timers()
+        self.due = {"right": 0, "left": 0}
+        # sequences play back over later scans instead of blocking this one
+        self.macros = MacroPlayer()
+        # MouseMove keys steer this, it moves the cursor on the scan clock
+        self.mouse_keys = MouseKeys(
+            backend.hid_devices()[1],
+            mouse_start_speed,
+            mouse_max_speed,
+            mouse_time_to_max_ms,
+            mouse_curve,
+            mouse_scroll_speed,
+            mouse_report_ms,
+        )
+        for layer in self.layers.values():
+            for side, side_keys in layer.items():
+                for idx, key in enumerate(side_keys):
+                    if hasattr(key, "sm"):
+                        key.sm.bind_timers(self.timers, side, 1 << idx)
+                        key.sm.bind_macros(self.macros)
+                    elif isinstance(key, keys.MouseMove):
+                        key.engine = self.mouse_keys
+
+        self.link = split_link.LinkReceiver()
+        self.link_errors = 0
+
+        # buffered HID outputs, flushed once at the end of every scan
+        self.hid_outputs = backend.hid_devices()
+
+        # per-stage timing histograms, None when off
+        self.stats = None
+        if latency_stats:
+            self.stats = scan_stats.ScanStats(backend.monotonic_ns, target_scan_ms)
+
+        # ring of raw matrix edges (see keytrace.py), None when off
+        self.recorder = None
+        if trace_size:
+            self.recorder = keytrace.TraceRecorder(self.n_keys, trace_size)
+        self.trace_file = trace_file
+
+        # collect in idle windows instead of mid-scan (gc_policy.py), None
+        # leaves it to the interpreter
+        self.gc_policy = None
+        if gc_idle_ms is not None:
+            self.gc_policy = GCPolicy(gc, backend.monotonic_ns, gc_idle_ms, gc_min_free)
+
+        # one clock sample per scan, shared by every state machine
+        self.now = backend.monotonic_ns()
+
+        self.counter = 0
+        self.fails = 0
+        self.prev_time = self.now
+
+    def flatten_layers(self, layers_dict, combos=()):
+        # layers_dict -> self.layers, one list per side in key index order
+        # with the combos' actions after the right half's keys; returns the
+        # layer names, the base layer's layer keys and the combos' key masks
+        self.layers = {name: {"right": [], "left": []} for name in layers_dict}
+        for side in ["right", "left"]:
+            for row_idx in self.row_pin_map:
+                for col_idx in self.col_pin_map:
+                    for layer in self.layers:
+                        self.layers[layer][side].append(
+                            layers_dict[layer][side].get(row_idx, {}).get(col_idx, None)
+                        )
+
+        combo_masks = []
+        for combo in combos:
+            mask = {"left": 0, "right": 0}
+            for side, row_idx, col_idx in combo.keys:
+                mask[side] |= 1 << self.key_index(row_idx, col_idx)
+            combo_masks.append((mask["left"], mask["right"]))
+            actions = combo.action
+            if not isinstance(actions, dict):
+                actions = {"base": actions}
+            for name in self.layers:
+                self.layers[name]["right"].append(actions.get(name))
+
+        layer_keys = []
+        for side in ["left", "right"]:
+            for idx, val in enumerate(self.layers["base"][side]):
+                if layer_key_target(val) is not None:
+                    layer_keys.append((side, idx, val))
+        return list(layers_dict), layer_keys, combo_masks
+
+    def load_compiled(self, compiled):
+        # same as flatten_layers() from the compiled tables, only the key
+        # objects themselves get built
+        if compiled.N_KEYS != self.n_keys:
+            raise ValueError("compiled keymap is for a different matrix")
+        actions = compiled.ACTIONS
+        # plain keys hold no state, so every position using an ACTIONS entry
+        # shares one object; keys with a state machine get their own
+        plain = {}
+
+        def build(i):
+            key = plain.get(i)
+            if key is None:
+                key = keys.from_action(actions[i])
+                if getattr(key, "plain", False):
+                    plain[i] = key
+            return key
+
+        self.layers = {}
+        for name, (left, right) in zip(compiled.LAYER_NAMES, compiled.KEYS):
+            self.layers[name] = {
+                "left": [build(i) for i in left],
+                "right": [build(i) for i in right],
+            }
+        base = self.layers["base"]
+        layer_keys = [(side, idx, base[side][idx]) for side, idx in compiled.LAYER_KEYS]
+        return list(compiled.LAYER_NAMES), layer_keys, list(compiled.COMBOS)
+
+    def key_index(self, row_idx, col_idx):
+        # keymap (row, col) -> bit position in the per-side state masks
+        rows = list(self.row_pin_map)
+        cols = list(self.col_pin_map)
+        return rows.index(row_idx) * len(cols) + cols.index(col_idx)
+
+    def set_state(self, side, bits, now):
+        if self.recorder is not None:
+            self.recorder.record(side, bits, now)
+        debouncer = self.debouncers[side]
+        if debouncer is not None:
+            bits = debouncer.update(bits, now)
+        self.matrix[side] = bits
+
+    def read_left(self, now):
+        # frames out of whatever link.drain() picked up since the last scan;
+        # with no new frames the left half keeps its last known state
+        link = self.link
+        link.parse()
+        errors = link.dropped + link.partial
+        self.fails += errors - self.link_errors
+        self.link_errors = errors
+        self.set_state("left", link.bits & self.key_mask, now)
+
+    def scan(self):
+        stats = self.stats
+        now = self.backend.monotonic_ns()
+        self.now = now
+        if stats:
+            stats.start(now)
+
+        # never blocks, only takes what the UART already has
+        self.link.drain(self.uart)
+        if stats:
+            stats.lap(scan_stats.UART)
+        self.read_left(now)
+        if stats:
+            stats.lap(scan_stats.DECODE)
+        self.scanner.scan()
+        self.set_state("right", self.scanner.bits, now)
+        if stats:
+            stats.lap(scan_stats.SCAN)
+
+        self.process(now)
+
+        gc_policy = self.gc_policy
+        if gc_policy is not None:
+            down = self.physical
+            active = self.active
+            busy = down["left"] | down["right"] | active["left"] | active["right"]
+            gc_policy.step(now, busy or self.macros.queue)
+        if stats:
+            stats.lap(scan_stats.GC)
+            stats.end()
+
+    def process(self, now):
+        # everything after the inputs: tap-hold, layers, state machines, HID
+        stats = self.stats
+        pressed = self.pressed
+        released = self.released
+        undecided = self.undecided
+        tap_hold = self.tap_hold
+
+        self.counter += 1
+
+        down = self.matrix
+        if self.combos is not None:
+            down = self.combos.update(down, now)
+        physical = self.physical
+        for side in SIDES:
+            bits = down[side]
+            prev = physical[side]
+            physical[side] = bits
+            pressed[side] = bits & ~prev
+            released[side] = prev & ~bits
+
+        due = self.due
+        due["left"] = due["right"] = 0
+        self.timers.expire(now, due)
+
+        if undecided["left"] | undecided["right"] or tap_hold.events:
+            # a tap-hold is undecided: this scan's edges queue up behind it
+            # and go out in order as far as it's been decided
+            for side in SIDES:
+                tap_hold.push(side, pressed[side], released[side])
+                pressed[side] = released[side] = 0
+            layer = None
+            if due["left"] | due["right"]:
+                layer = self.layer_engine.resolve(self.state, pressed)
+            if stats:
+                stats.lap(scan_stats.LAYER)
+            if layer is not None:
+                self.dispatch(now, layer)
+                due["left"] = due["right"] = 0
+            if stats:
+                stats.lap(scan_stats.DISPATCH)
+            # replaying the queue, layers and machines included, is tap-hold
+            # time
+            self.drain(now)
+            if stats:
+                stats.lap(scan_stats.HOLD)
+        else:
+            state = self.state
+            held_back = self.held_back
+            held_back["left"] = held_back["right"] = 0
+            tap_hold_keys = self.tap_hold_keys
+            if (
+                pressed["left"] & tap_hold_keys["left"]
+                or pressed["right"] & tap_hold_keys["right"]
+            ) and tap_hold.policy != "hold_on_other_key_press":
+                # a tap-hold goes down: it goes first, the other keys pressed
+                # in the same scan queue up behind it like later ones would
+                for side in SIDES:
+                    held = pressed[side] & ~tap_hold_keys[side]
+                    held_back[side] = held
+                    pressed[side] ^= held
+            state["left"] = physical["left"] & ~held_back["left"]
+            state["right"] = physical["right"] & ~held_back["right"]
+            layer = self.layer_engine.resolve(state, pressed)
+            if stats:
+                stats.lap(scan_stats.LAYER)
+            self.dispatch(now, layer)
+            if stats:
+                stats.lap(scan_stats.DISPATCH)
+            if held_back["left"] | held_back["right"]:
+                for side in SIDES:
+                    tap_hold.push(side, held_back[side], 0)
+                self.drain(now)
+            elif undecided["left"] | undecided["right"]:
+                # hold_on_other_key_press lets other keys that went down in
+                # the same scan go out with the tap-hold, they make it a hold
+                if tap_hold.policy == "hold_on_other_key_press":
+                    for side in SIDES:
+                        pending = undecided[side]
+                        while pending:
+                            bit = pending & -pending
+                            pending ^= bit
+                            if pressed[side] & ~bit or pressed[OTHER[side]]:
+                                self.decide(side, bit, now)
+            if stats:
+                stats.lap(scan_stats.HOLD)
+
+        if self.macros.queue:
+            self.macros.tick(now)
+        if self.mouse_keys.held:
+            self.mouse_keys.tick(now)
+        if stats:
+            stats.lap(scan_stats.TICK)
+
+        for output in self.hid_outputs:
+            output.flush()
+        if stats:
+            stats.lap(scan_stats.HID)
+
+    def dispatch(self, now, layer):
+        # ticks the machines of the active keys for the current state/edges
+        state = self.state
+        pressed = self.pressed
+        released = self.released
+        due = self.due
+        layer_info = self.layer_info
+        le_layer = self.layers[layer]
+        tap_hold = self.tap_hold
+        if tap_hold.retro >= 0 and pressed["left"] | pressed["right"]:
+            tap_hold.retro = -1
+
+        bit_index = self.bit_index
+        for side in SIDES:
+            le_state = state[side]
+            le_final = self.final[side]
+            le_layer_side = le_layer[side]
+            layer_info_side = layer_info[side]
+            side_code = keytrace.LEFT if side == "left" else 0
+            # plain keys go straight from their edges; their final entry stays
+            # put while they're down, so that's what gets released
+            plain_down = self.plain_down[side]
+            up = released[side] & plain_down
+            if up:
+                plain_down ^= up
+                while up:
+                    bit = up & -up
+                    up ^= bit
+                    le_final[bit_index[bit]].release()
+
+            was_undecided = self.undecided[side]
+            undecided = 0
+            active = self.active[side] | pressed[side]
+            changed = pressed[side] | released[side] | due[side]
+            pending = active
+            while pending:
+                bit = pending & -pending
+                pending ^= bit
+                idx = bit_index[bit]
+                key_state = (le_state >> idx) & 1
+                key_final = le_final[idx]
+
+                if key_final in layer_info_side or key_final is None:
+                    active ^= bit
+                    continue
+
+                if key_final.plain:
+                    idle = True
+                else:
+                    if key_final.sm.parked and not bit & changed:
+                        undecided |= bit
+                        continue
+                    idle = key_final.sm.idle
+
+                if idle:
+                    if le_layer_side[idx] is not None:
+                        le_final[idx] = le_layer_side[idx]
+                    else:
+                        le_final[idx] = key_final
+                actual_final = le_final[idx]
+                if actual_final in layer_info_side:
+                    active ^= bit
+                    continue
+
+                if actual_final.plain:
+                    if key_state:
+                        actual_final.press()
+                        plain_down |= bit
+                    active ^= bit
+                    continue
+
+                sm = actual_final.sm
+                sm.update(key_state, now)
+                if sm.parked:
+                    # a tap-hold waiting to be decided
+                    undecided |= bit
+                    if (
+                        tap_hold.retro_tap
+                        and pressed[side] == bit
+                        and not pressed[OTHER[side]]
+                    ):
+                        tap_hold.retro = side_code | idx
+                elif not key_state:
+                    if (
+                        tap_hold.retro == side_code | idx
+                        and bit & released[side]
+                        and not bit & was_undecided
+                    ):
+                        # held past its timeout with nothing else pressed
+                        tap_hold.retro = -1
+                        if hasattr(actual_final, "retro_tap"):
+                            actual_final.retro_tap()
+                    if sm.idle:
+                        active ^= bit
+            self.active[side] = active
+            self.plain_down[side] = plain_down
+            self.undecided[side] = undecided
+
+    def deliver(self, side, bit, down, now):
+        # one queued edge, run through layers and machines on its own
+        state = self.state
+        pressed = self.pressed
+        released = self.released
+        pressed["left"] = pressed["right"] = 0
+        released["left"] = released["right"] = 0
+        if down:
+            state[side] |= bit
+            pressed[side] = bit
+        else:
+            state[side] &= ~bit
+            released[side] = bit
+        self.dispatch(now, self.layer_engine.resolve(state, pressed))
+
+    def drain(self, now):
+        # replays queued edges in order: an undecided key's own edges get
+        # through, the rest wait until nothing is undecided
+        events = self.tap_hold.events
+        undecided = self.undecided
+        while True:
+            i = 0
+            while i < len(events):
+                code = events[i]
+                side = "left" if code & keytrace.LEFT else "right"
+                bit = 1 << (code & keytrace.INDEX)
+                if undecided["left"] | undecided["right"] and not undecided[side] & bit:
+                    i += 1
+                    continue
+                del events[i]
+                if not undecided[side] & bit:
+                    # its own report, after whatever the tap-hold sent
+                    for output in self.hid_outputs:
+                        output.flush()
+                self.deliver(side, bit, code & keytrace.DOWN, now)
+                i = 0
+            if not events or not self.settle(now):
+                return
+
+    def settle(self, now):
+        # lets the tap-hold policy decide undecided keys from the queue,
+        # True if any of them got decided
+        undecided = self.undecided
+        tap_hold = self.tap_hold
+        decided = False
+        for side in SIDES:
+            side_code = keytrace.LEFT if side == "left" else 0
+            pending = undecided[side]
+            while pending:
+                bit = pending & -pending
+                pending ^= bit
+                idx = self.bit_index[bit]
+                waiting = self.final[side][idx].sm.cur_state
+                inverted = getattr(waiting, "inverted", False)
+                if tap_hold.wants_hold(side_code | idx, inverted):
+                    self.decide(side, bit, now)
+                    if not undecided[side] & bit:
+                        decided = True
+        return decided
+
+    def decide(self, side, bit, now):
+        # tells an undecided tap-hold another key wants it decided
+        idx = self.bit_index[bit]
+        sm = self.final[side][idx].sm
+        sm.update((self.state[side] >> idx) & 1, now, True)
+        if not sm.parked:
+            self.undecided[side] &= ~bit
+
+    def replay(self, entries, scan_ns=1000000):
+        # runs a recorded trace (keytrace.py) through debounce, layers and
+        # the state machines in place of the matrix and link, with the clock
+        # stepped from the trace; HID output goes out as normal. The stepped
+        # clock ends where the real one is, so whatever the trace leaves
+        # scheduled (macro steps, tap-hold deadlines, mouse reports) comes
+        # due on the real clock afterwards
+        recorder = self.recorder
+        stats = self.stats
+        self.recorder = self.stats = None
+        start = self.backend.monotonic_ns() - keytrace.replay_ns(entries)
+        self.macros.ready_at = min(self.macros.ready_at, start)
+        for t, left, right in keytrace.replay_scans(entries, scan_ns):
+            now = start + t
+            self.now = now
+            self.set_state("left", left, now)
+            self.set_state("right", right, now)
+            self.process(now)
+        self.prev_time = self.backend.monotonic_ns()
+        self.recorder = recorder
+        self.stats = stats
+
+    def save_trace(self):
+        try:
+            self.recorder.save(self.trace_file)
+            print("trace saved to", self.trace_file)
+        except OSError as e:
+            # read-only unless boot.py's WRITABLE is on
+            print("can't save trace:", e)
+
+    def run(self, report_every=500):
+        while True:
+            try:
+                self.scan()
+                if self.counter % report_every == 0:
+                    now = self.now
+                    print(
+                        ((now - self.prev_time) / report_every / 1000000),
+                        (self.fails / report_every),
+                    )
+                    self.prev_time = now
+                    self.fails = 0
+                    if self.gc_policy:
+                        self.gc_policy.report()
+                    if self.stats or self.recorder:
+                        command = self.backend.console_read()
+                        if command == "s" and self.stats:
+                            self.stats.dump()
+                            self.stats.reset()
+                        elif command == "t" and self.recorder:
+                            self.save_trace()
+            except Exception as e:
+                print(e)
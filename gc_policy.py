@@ -0,0 +1,70 @@
+# Garbage collection on our schedule instead of whenever the heap fills up.
+# Automatic collection is off while keys are in use; once nothing has been
+# down or in play for idle_ms the heap is collected and automatic collection
+# goes back on until the next key press. If free memory drops below min_free
+# while typing it's collected then anyway, rather than running out; that's
+# only checked every check_ms, since gc.mem_free() walks the whole heap.
+#
+# Pauses are timed with the scan clock: collections, how many were forced by
+# low memory, and the last and longest pause in ns.
+
+
+class GCPolicy:
+    def __init__(self, gc, clock, idle_ms=50, min_free=16384, check_ms=20):
+        self.gc = gc
+        self.clock = clock  # monotonic_ns
+        self.idle = int(idle_ms * 1000000)
+        self.min_free = min_free
+        self.check = int(check_ms * 1000000)
+        # CPython's gc has no mem_free(), there it's idle collections only
+        self.mem_free = getattr(gc, "mem_free", None)
+        self.busy = True
+        self.busy_at = clock()
+        self.checked_at = self.busy_at
+        self.collections = 0
+        self.low_memory = 0
+        self.last_pause = 0
+        self.max_pause = 0
+        gc.disable()
+
+    def collect(self):
+        start = self.clock()
+        self.gc.collect()
+        pause = self.clock() - start
+        self.collections += 1
+        self.last_pause = pause
+        if pause > self.max_pause:
+            self.max_pause = pause
+
+    def step(self, now, busy):
+        # once per scan, busy while any key is down or a machine/macro runs
+        if busy:
+            if not self.busy:
+                self.gc.disable()
+                self.busy = True
+            self.busy_at = now
+        elif self.busy and now - self.busy_at >= self.idle:
+            self.collect()
+            self.gc.enable()
+            self.busy = False
+            return
+        if not self.busy or self.mem_free is None:
+            return
+        if now - self.checked_at < self.check:
+            return
+        self.checked_at = now
+        if self.mem_free() < self.min_free:
+            self.low_memory += 1
+            self.collect()
+
+    def report(self):
+        print(
+            "gc: %d collections (%d low memory), last %dus, max %dus"
+            % (
+                self.collections,
+                self.low_memory,
+                self.last_pause // 1000,
+                self.max_pause // 1000,
+            )
+        )
+        self.max_pause = 0
@@ -0,0 +1,112 @@
+import time
+
+from hid_output import KeyboardReport, NkroReport, ConsumerReport, MouseReport
+
+# Hardware backends. The firmware only talks to pins, the UART, the HID
+# devices and the clock through one of these, so the same scan loop runs on
+# the board (CircuitPythonBackend) and on a PC (host_sim.HostBackend).
+
+
+class CircuitPythonBackend:
+    def __init__(self, nkro=True):
+        import board
+        import digitalio
+
+        self.board = board
+        self.digitalio = digitalio
+        self.nkro = nkro
+        self.hid = None
+
+    def pin(self, name):
+        return getattr(self.board, name)
+
+    def input_pin(self, name):
+        key_pin = self.digitalio.DigitalInOut(self.pin(name))
+        key_pin.direction = self.digitalio.Direction.INPUT
+        key_pin.pull = self.digitalio.Pull.UP
+        return key_pin
+
+    def output_pin(self, name):
+        key_pin = self.digitalio.DigitalInOut(self.pin(name))
+        key_pin.direction = self.digitalio.Direction.OUTPUT
+        key_pin.value = True
+        return key_pin
+
+    def key_matrix(self, row_names, col_names, interval=0.001):
+        import keypad
+
+        return keypad.KeyMatrix(
+            row_pins=[self.pin(name) for name in row_names],
+            column_pins=[self.pin(name) for name in col_names],
+            interval=interval,
+        )
+
+    def key_event(self):
+        import keypad
+
+        return keypad.Event()
+
+    def uart(self, tx, rx, baudrate=115200, receiver_buffer_size=256):
+        import busio
+
+        return busio.UART(
+            self.pin(tx),
+            self.pin(rx),
+            baudrate=baudrate,
+            receiver_buffer_size=receiver_buffer_size,
+        )
+
+    def hid_devices(self):
+        # (keyboard, mouse, consumer control) as buffered outputs, see
+        # hid_output.py. The adafruit_hid objects are only made to wait for
+        # the host to enumerate us. The keyboard is boot.py's n-key rollover
+        # one, unless that's off or missing, then the standard six-key one.
+        if self.hid is not None:
+            return self.hid
+
+        import usb_hid
+        from adafruit_hid import find_device
+        from adafruit_hid.keyboard import Keyboard
+        from adafruit_hid.consumer_control import ConsumerControl
+        from adafruit_hid.mouse import Mouse
+
+        while True:
+            try:
+                Mouse(usb_hid.devices)
+                Keyboard(usb_hid.devices)
+                ConsumerControl(usb_hid.devices)
+                break
+            except Exception:
+                pass
+
+        devices = usb_hid.devices
+        # in the order boot.py enabled them, the standard keyboard first
+        keyboards = [d for d in devices if d.usage_page == 0x1 and d.usage == 0x06]
+        if self.nkro and len(keyboards) > 1:
+            keyboard = NkroReport(keyboards[1])
+        else:
+            keyboard = KeyboardReport(keyboards[0])
+        self.hid = (
+            keyboard,
+            MouseReport(find_device(devices, usage_page=0x1, usage=0x02)),
+            ConsumerReport(find_device(devices, usage_page=0x0C, usage=0x01)),
+        )
+        return self.hid
+
+    def console_read(self):
+        # a character typed on the serial console, None if there's nothing
+        import supervisor
+        import sys
+
+        if supervisor.runtime.serial_bytes_available:
+            return sys.stdin.read(1)
+        return None
+
+    def monotonic(self):
+        return time.monotonic()
+
+    def monotonic_ns(self):
+        return time.monotonic_ns()
+
+    def sleep(self, seconds):
+        time.sleep(seconds)
@@ -0,0 +1,135 @@
+# Keycode/ConsumerControlCode/Mouse constants. On the board these come from
+# adafruit_hid, on the host (CPython can't load the .mpy files) we fall back
+# to stand-ins with the same names and values.
+
+try:
+    from adafruit_hid.keycode import Keycode
+    from adafruit_hid.consumer_control_code import ConsumerControlCode
+    from adafruit_hid.mouse import Mouse
+except ImportError:
+
+    class Keycode:
+        A = 0x04
+        B = 0x05
+        C = 0x06
+        D = 0x07
+        E = 0x08
+        F = 0x09
+        G = 0x0A
+        H = 0x0B
+        I = 0x0C
+        J = 0x0D
+        K = 0x0E
+        L = 0x0F
+        M = 0x10
+        N = 0x11
+        O = 0x12
+        P = 0x13
+        Q = 0x14
+        R = 0x15
+        S = 0x16
+        T = 0x17
+        U = 0x18
+        V = 0x19
+        W = 0x1A
+        X = 0x1B
+        Y = 0x1C
+        Z = 0x1D
+        ONE = 0x1E
+        TWO = 0x1F
+        THREE = 0x20
+        FOUR = 0x21
+        FIVE = 0x22
+        SIX = 0x23
+        SEVEN = 0x24
+        EIGHT = 0x25
+        NINE = 0x26
+        ZERO = 0x27
+        ENTER = 0x28
+        RETURN = ENTER
+        ESCAPE = 0x29
+        BACKSPACE = 0x2A
+        TAB = 0x2B
+        SPACEBAR = 0x2C
+        SPACE = SPACEBAR
+        MINUS = 0x2D
+        EQUALS = 0x2E
+        LEFT_BRACKET = 0x2F
+        RIGHT_BRACKET = 0x30
+        BACKSLASH = 0x31
+        POUND = 0x32
+        SEMICOLON = 0x33
+        QUOTE = 0x34
+        GRAVE_ACCENT = 0x35
+        COMMA = 0x36
+        PERIOD = 0x37
+        FORWARD_SLASH = 0x38
+        CAPS_LOCK = 0x39
+        F1 = 0x3A
+        F2 = 0x3B
+        F3 = 0x3C
+        F4 = 0x3D
+        F5 = 0x3E
+        F6 = 0x3F
+        F7 = 0x40
+        F8 = 0x41
+        F9 = 0x42
+        F10 = 0x43
+        F11 = 0x44
+        F12 = 0x45
+        PRINT_SCREEN = 0x46
+        SCROLL_LOCK = 0x47
+        PAUSE = 0x48
+        INSERT = 0x49
+        HOME = 0x4A
+        PAGE_UP = 0x4B
+        DELETE = 0x4C
+        END = 0x4D
+        PAGE_DOWN = 0x4E
+        RIGHT_ARROW = 0x4F
+        LEFT_ARROW = 0x50
+        DOWN_ARROW = 0x51
+        UP_ARROW = 0x52
+        LEFT_CONTROL = 0xE0
+        CONTROL = LEFT_CONTROL
+        LEFT_SHIFT = 0xE1
+        SHIFT = LEFT_SHIFT
+        LEFT_ALT = 0xE2
+        ALT = LEFT_ALT
+        OPTION = ALT
+        LEFT_GUI = 0xE3
+        GUI = LEFT_GUI
+        WINDOWS = GUI
+        COMMAND = GUI
+        RIGHT_CONTROL = 0xE4
+        RIGHT_SHIFT = 0xE5
+        RIGHT_ALT = 0xE6
+        RIGHT_GUI = 0xE7
+
+        @classmethod
+        def modifier_bit(cls, keycode):
+            return (
+                1 << (keycode - 0xE0)
+                if cls.LEFT_CONTROL <= keycode <= cls.RIGHT_GUI
+                else 0
+            )
+
+    class ConsumerControlCode:
+        RECORD = 0xB2
+        FAST_FORWARD = 0xB3
+        REWIND = 0xB4
+        SCAN_NEXT_TRACK = 0xB5
+        SCAN_PREVIOUS_TRACK = 0xB6
+        STOP = 0xB7
+        EJECT = 0xB8
+        PLAY_PAUSE = 0xCD
+        MUTE = 0xE2
+        VOLUME_DECREMENT = 0xEA
+        VOLUME_INCREMENT = 0xE9
+        BRIGHTNESS_DECREMENT = 0x70
+        BRIGHTNESS_INCREMENT = 0x6F
+
+    class Mouse:
+        LEFT_BUTTON = 1
+        RIGHT_BUTTON = 2
+        MIDDLE_BUTTON = 4
@@ -0,0 +1,267 @@
+# Buffered HID outputs. They take the same press()/release()/move() calls as
+# the adafruit_hid Keyboard/ConsumerControl/Mouse objects, but only change an
+# in-memory report; flush(), called once at the end of every scan, sends at
+# most one report per device. A key pressed and released before its report
+# went out (a tap) is released in the following report so the host still
+# sees it.
+
+# modifier byte plus a bitmap of keycodes 0x00-0xDF, see boot.py
+NKRO_REPORT_LENGTH = 29
+
+
+class KeyboardReport:
+    def __init__(self, device):
+        self.device = device
+        # modifier bits, reserved, six key slots
+        self.report = bytearray(8)
+        self.fresh = []  # pressed since the last report
+        self.taps = []  # released before the press was sent
+        self.released = []  # released since the last report
+        self.dirty = False
+
+    def _add(self, keycode):
+        report = self.report
+        if 0xE0 <= keycode <= 0xE7:
+            report[0] |= 1 << (keycode - 0xE0)
+            return
+        for i in range(2, 8):
+            if report[i] == keycode:
+                return
+        for i in range(2, 8):
+            if not report[i]:
+                report[i] = keycode
+                return
+        raise ValueError("Trying to press more than six keys at once.")
+
+    def _remove(self, keycode):
+        report = self.report
+        if 0xE0 <= keycode <= 0xE7:
+            report[0] &= ~(1 << (keycode - 0xE0)) & 0xFF
+            return
+        for i in range(2, 8):
+            if report[i] == keycode:
+                report[i] = 0
+
+    def press(self, *keycodes):
+        for keycode in keycodes:
+            if keycode in self.released:
+                # the host has to see it go up before it goes down again
+                self.send()
+            self._add(keycode)
+            self.fresh.append(keycode)
+        self.dirty = True
+
+    def release(self, *keycodes):
+        for keycode in keycodes:
+            if keycode in self.fresh:
+                if keycode not in self.taps:
+                    self.taps.append(keycode)
+            else:
+                self._remove(keycode)
+                self.released.append(keycode)
+        self.dirty = True
+
+    def release_all(self):
+        report = self.report
+        for bit in range(8):
+            if report[0] & (1 << bit):
+                self.release(0xE0 + bit)
+        for i in range(2, 8):
+            if report[i]:
+                self.release(report[i])
+
+    def send(self):
+        self.device.send_report(self.report)
+        self.fresh.clear()
+        self.released.clear()
+        self.dirty = False
+
+    def flush(self):
+        if not self.dirty:
+            return
+        self.send()
+        if self.taps:
+            for keycode in self.taps:
+                self._remove(keycode)
+                self.released.append(keycode)
+            self.taps.clear()
+            self.dirty = True
+
+
+class NkroReport:
+    # n-key rollover: modifier bits, then one bit per keycode 0x00-0xDF (see
+    # boot.py for the descriptor), so pressing a key sets a bit and nothing
+    # ever runs out of slots. Same taps and re-press handling as
+    # KeyboardReport, kept as bitmaps in the same layout as the report.
+    def __init__(self, device):
+        self.device = device
+        self.report = bytearray(NKRO_REPORT_LENGTH)
+        self.fresh = bytearray(NKRO_REPORT_LENGTH)  # pressed since last report
+        self.taps = bytearray(NKRO_REPORT_LENGTH)  # released before it went out
+        self.released = bytearray(NKRO_REPORT_LENGTH)  # since the last report
+        self.tapped = False
+        self.dirty = False
+
+    def press(self, *keycodes):
+        report = self.report
+        for keycode in keycodes:
+            if 0xE0 <= keycode <= 0xE7:
+                i = 0
+                bit = 1 << (keycode - 0xE0)
+            else:
+                i = 1 + (keycode >> 3)
+                bit = 1 << (keycode & 7)
+            if self.released[i] & bit:
+                # the host has to see it go up before it goes down again
+                self.send()
+            report[i] |= bit
+            self.fresh[i] |= bit
+        self.dirty = True
+
+    def release(self, *keycodes):
+        report = self.report
+        for keycode in keycodes:
+            if 0xE0 <= keycode <= 0xE7:
+                i = 0
+                bit = 1 << (keycode - 0xE0)
+            else:
+                i = 1 + (keycode >> 3)
+                bit = 1 << (keycode & 7)
+            if self.fresh[i] & bit:
+                self.taps[i] |= bit
+                self.tapped = True
+            else:
+                report[i] &= ~bit & 0xFF
+                self.released[i] |= bit
+        self.dirty = True
+
+    def release_all(self):
+        report = self.report
+        fresh = self.fresh
+        for i in range(NKRO_REPORT_LENGTH):
+            held = report[i]
+            if held:
+                if held & fresh[i]:
+                    self.taps[i] |= held & fresh[i]
+                    self.tapped = True
+                report[i] = held & fresh[i]
+                self.released[i] |= held & ~fresh[i]
+                self.dirty = True
+
+    def send(self):
+        self.device.send_report(self.report)
+        fresh = self.fresh
+        released = self.released
+        for i in range(NKRO_REPORT_LENGTH):
+            fresh[i] = 0
+            released[i] = 0
+        self.dirty = False
+
+    def flush(self):
+        if not self.dirty:
+            return
+        self.send()
+        if self.tapped:
+            report = self.report
+            taps = self.taps
+            for i in range(NKRO_REPORT_LENGTH):
+                tapped = taps[i]
+                if tapped:
+                    report[i] &= ~tapped & 0xFF
+                    self.released[i] |= tapped
+                    taps[i] = 0
+            self.tapped = False
+            self.dirty = True
+
+
+class ConsumerReport:
+    def __init__(self, device):
+        self.device = device
+        self.report = bytearray(2)
+        self.fresh = False
+        self.tap = False
+        self.dirty = False
+
+    def press(self, consumer_code):
+        self.report[0] = consumer_code & 0xFF
+        self.report[1] = (consumer_code >> 8) & 0xFF
+        self.fresh = True
+        self.tap = False
+        self.dirty = True
+
+    def release(self):
+        if self.fresh:
+            self.tap = True
+            return
+        self.report[0] = self.report[1] = 0
+        self.dirty = True
+
+    def send(self):
+        self.device.send_report(self.report)
+        self.fresh = False
+        self.dirty = False
+
+    def flush(self):
+        if not self.dirty:
+            return
+        self.send()
+        if self.tap:
+            self.report[0] = self.report[1] = 0
+            self.tap = False
+            self.dirty = True
+
+
+class MouseReport:
+    def __init__(self, device):
+        self.device = device
+        # buttons, x, y, wheel
+        self.report = bytearray(4)
+        self.buttons = 0
+        self.fresh = 0  # buttons pressed since the last report
+        self.taps = 0
+        self.x = self.y = self.wheel = 0
+        self.dirty = False
+
+    def press(self, buttons):
+        self.buttons |= buttons
+        self.fresh |= buttons
+        self.dirty = True
+
+    def release(self, buttons):
+        self.taps |= buttons & self.fresh
+        self.buttons &= ~(buttons & ~self.fresh)
+        self.dirty = True
+
+    def release_all(self):
+        self.release(self.buttons)
+
+    def click(self, buttons):
+        self.press(buttons)
+        self.release(buttons)
+
+    def move(self, x=0, y=0, wheel=0):
+        # deltas from every call this scan add up into one report, clamped to
+        # what a report can carry
+        self.x += x
+        self.y += y
+        self.wheel += wheel
+
+    def flush(self):
+        if not (self.dirty or self.x or self.y or self.wheel):
+            return
+        x = max(-127, min(127, self.x))
+        y = max(-127, min(127, self.y))
+        wheel = max(-127, min(127, self.wheel))
+        report = self.report
+        report[0] = self.buttons
+        report[1] = x & 0xFF
+        report[2] = y & 0xFF
+        report[3] = wheel & 0xFF
+        self.device.send_report(report)
+        self.x = self.y = self.wheel = 0
+        self.fresh = 0
+        self.dirty = False
+        if self.taps:
+            self.buttons &= ~self.taps
+            self.taps = 0
+            self.dirty = True
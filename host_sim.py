@@ -0,0 +1,342 @@
+import time
+
+import keys
+import keymap
+from firmware import Firmware
+from left_scanner import LeftScanner
+from hid_output import (
+    KeyboardReport,
+    NkroReport,
+    NKRO_REPORT_LENGTH,
+    ConsumerReport,
+    MouseReport,
+)
+
+# CPython stand-in for the board: fake matrix pins, a loopback UART fed by a
+# simulated left half, recording HID devices and a virtual clock. Lets the
+# real keymap and scan loop run (and be profiled) on a PC.
+#
+#   sim = Simulator()
+#   sim.run([(0.01, {(2, 3)}, set()), (0.01, set(), set())])
+#   print([keyboard_keys(r) for r in sim.keyboard.reports])
+#
+# A trace saved on the board replays the same way:
+#   Simulator().fw.replay(keytrace.load("trace.txt"))
+
+
+class SimClock:
+    def __init__(self, start=0.0):
+        self.now_ns = int(start * 1e9)
+
+    def advance(self, seconds):
+        self.now_ns += int(seconds * 1e9)
+
+    def monotonic(self):
+        return self.now_ns / 1e9
+
+    def monotonic_ns(self):
+        return self.now_ns
+
+    def sleep(self, seconds):
+        self.advance(seconds)
+
+
+class SimOutputPin:
+    def __init__(self):
+        self.value = True
+
+
+class SimInputPin:
+    def __init__(self, matrix, col):
+        self.matrix = matrix
+        self.col = col
+
+    @property
+    def value(self):
+        # pulled up, reads low when a pressed switch connects it to a driven row
+        return not self.matrix.reads_low(self.col)
+
+
+class SimMatrix:
+    def __init__(self):
+        self.rows = []
+        self.cols = []
+        self.pressed = set()  # (row position, col position)
+
+    def output_pin(self):
+        pin = SimOutputPin()
+        self.rows.append(pin)
+        return pin
+
+    def input_pin(self):
+        pin = SimInputPin(self, len(self.cols))
+        self.cols.append(pin)
+        return pin
+
+    def reads_low(self, col):
+        for row, pin in enumerate(self.rows):
+            if not pin.value and (row, col) in self.pressed:
+                return True
+        return False
+
+
+class SimKeyEvent:
+    def __init__(self):
+        self.key_number = 0
+        self.pressed = False
+        self.timestamp = 0
+
+
+class SimEventQueue:
+    def __init__(self, key_matrix):
+        self.key_matrix = key_matrix
+        self.queue = []
+        self.overflowed = False
+
+    def get_into(self, event):
+        self.key_matrix.poll()
+        if not self.queue:
+            return False
+        event.key_number, event.pressed, event.timestamp = self.queue.pop(0)
+        return True
+
+    def clear(self):
+        self.queue.clear()
+        self.overflowed = False
+
+
+class SimKeyMatrix:
+    # keypad.KeyMatrix stand-in: turns changes in the simulated matrix into
+    # queued events, as the background scan would
+    def __init__(self, matrix, n_rows, n_cols, clock):
+        self.matrix = matrix
+        self.n_cols = n_cols
+        self.key_count = n_rows * n_cols
+        self.clock = clock
+        self.down = set()
+        self.events = SimEventQueue(self)
+
+    def poll(self):
+        now = set(r * self.n_cols + c for r, c in self.matrix.pressed)
+        timestamp = self.clock.monotonic_ns() // 1000000
+        for key in sorted(now ^ self.down):
+            self.events.queue.append((key, key in now, timestamp))
+        self.down = now
+
+    def reset(self):
+        self.down = set()
+
+
+class SimUART:
+    def __init__(self, peer=None):
+        # with a peer, writes land in the peer's receive buffer
+        self.peer = peer
+        self.buffer = bytearray()
+        self.written = bytearray()
+
+    @property
+    def in_waiting(self):
+        return len(self.buffer)
+
+    def feed(self, data):
+        self.buffer.extend(data)
+
+    def read(self, nbytes=None):
+        if not self.buffer:
+            return None
+        if nbytes is None:
+            nbytes = len(self.buffer)
+        data = bytes(self.buffer[:nbytes])
+        del self.buffer[:nbytes]
+        return data
+
+    def readinto(self, buf):
+        n = min(len(buf), len(self.buffer))
+        if not n:
+            return None
+        buf[:n] = self.buffer[:n]
+        del self.buffer[:n]
+        return n
+
+    def readline(self):
+        end = self.buffer.find(b"\n")
+        if end < 0:
+            return self.read()
+        return self.read(end + 1)
+
+    def write(self, data):
+        if self.peer is not None:
+            self.peer.feed(data)
+        else:
+            self.written.extend(data)
+        return len(data)
+
+    def reset_input_buffer(self):
+        pass
+
+
+class SimHIDDevice:
+    # usb_hid.Device stand-in, keeps a copy of every report sent
+    def __init__(self):
+        self.reports = []
+
+    def send_report(self, report):
+        self.reports.append(bytes(report))
+
+
+def keyboard_keys(report):
+    # keycodes held in a keyboard report (standard or NKRO), modifiers first
+    held = [0xE0 + bit for bit in range(8) if report[0] & (1 << bit)]
+    if len(report) == NKRO_REPORT_LENGTH:
+        return tuple(
+            held
+            + [k for k in range(0xE0) if report[1 + (k >> 3)] & (1 << (k & 7))]
+        )
+    return tuple(held + [k for k in report[2:] if k])
+
+
+class HostBackend:
+    def __init__(self, clock=None, nkro=False):
+        self.clock = clock or SimClock()
+        self.matrix = SimMatrix()
+        self.uart_rx = SimUART()
+        self.keyboard = SimHIDDevice()
+        self.mouse = SimHIDDevice()
+        self.concon = SimHIDDevice()
+        self.hid = (
+            (NkroReport if nkro else KeyboardReport)(self.keyboard),
+            MouseReport(self.mouse),
+            ConsumerReport(self.concon),
+        )
+
+    def input_pin(self, name):
+        return self.matrix.input_pin()
+
+    def output_pin(self, name):
+        return self.matrix.output_pin()
+
+    def key_matrix(self, row_names, col_names, interval=0.001):
+        return SimKeyMatrix(self.matrix, len(row_names), len(col_names), self.clock)
+
+    def key_event(self):
+        return SimKeyEvent()
+
+    def uart(self, tx, rx, baudrate=115200, receiver_buffer_size=256):
+        return self.uart_rx
+
+    def hid_devices(self):
+        return self.hid
+
+    def console_read(self):
+        return None
+
+    def monotonic(self):
+        return self.clock.monotonic()
+
+    def monotonic_ns(self):
+        return self.clock.monotonic_ns()
+
+    def sleep(self, seconds):
+        self.clock.sleep(seconds)
+
+
+class SimLeftMatrix:
+    # scanner stand-in for the left half, its keys are set directly
+    def __init__(self, n_keys):
+        self.n_keys = n_keys
+        self.pressed = set()  # key indices
+        self.bits = 0
+
+    def scan(self):
+        bits = 0
+        for i in self.pressed:
+            bits |= 1 << i
+        self.bits = bits
+
+
+class Simulator:
+    def __init__(
+        self,
+        layers_builder=keymap.build_layers,
+        combos_builder=keymap.build_combos,
+        backend=None,
+        matrix_backend=keymap.matrix_backend,
+        latency_stats=False,
+        trace_size=0,
+        compiled=None,
+        gc_idle_ms=None,
+        tap_hold_policy=keymap.tap_hold_policy,
+        retro_tap=keymap.retro_tap,
+        nkro=keymap.nkro,
+    ):
+        self.backend = backend or HostBackend(nkro=nkro)
+        self.keyboard = self.backend.keyboard
+        self.mouse = self.backend.mouse
+        self.concon = self.backend.concon
+        keys.bind_devices(*self.backend.hid_devices())
+        self.fw = Firmware(
+            self.backend,
+            None if compiled else layers_builder(),
+            keymap.row_pin_map,
+            keymap.col_pin_map,
+            keymap.uart_pins,
+            keymap.tri_layers,
+            debounce=keymap.debounce,
+            debounce_ms=keymap.debounce_ms,
+            debounce_left=keymap.debounce_left,
+            matrix_backend=matrix_backend,
+            latency_stats=latency_stats,
+            trace_size=trace_size,
+            compiled=compiled,
+            gc_idle_ms=gc_idle_ms,
+            tap_hold_policy=tap_hold_policy,
+            retro_tap=retro_tap,
+            combos=() if compiled else combos_builder(),
+            combo_term_ms=keymap.combo_term_ms,
+            mouse_start_speed=keymap.mouse_start_speed,
+            mouse_max_speed=keymap.mouse_max_speed,
+            mouse_time_to_max_ms=keymap.mouse_time_to_max_ms,
+            mouse_curve=keymap.mouse_curve,
+            mouse_scroll_speed=keymap.mouse_scroll_speed,
+            mouse_report_ms=keymap.mouse_report_ms,
+        )
+        self.left_matrix = SimLeftMatrix(self.fw.n_keys)
+        self.left = LeftScanner(
+            self.left_matrix, SimUART(self.backend.uart_rx), self.backend.clock
+        )
+
+    def set_keys(self, left=(), right=()):
+        # keys are keymap (row, col) pairs, as in layers_dict
+        self.left_matrix.pressed = set(self.fw.key_index(r, c) for r, c in left)
+        rows = list(self.fw.row_pin_map)
+        cols = list(self.fw.col_pin_map)
+        self.backend.matrix.pressed = set(
+            (rows.index(r), cols.index(c)) for r, c in right
+        )
+
+    def step(self, dt=0.001):
+        self.backend.clock.advance(dt)
+        self.left.step()
+        self.fw.scan()
+
+    def run(self, frames):
+        # frames: iterable of (dt, left keys, right keys)
+        for dt, left, right in frames:
+            self.set_keys(left, right)
+            self.step(dt)
+
+
+if __name__ == "__main__":
+    sim = Simulator()
+    frames = []
+    for row, col in [(1, 6), (1, 4), (1, 1)]:  # Y I MINUS on the right
+        frames.extend([(0.001, (), [(row, col)])] * 20)
+        frames.extend([(0.001, (), ())] * 20)
+    frames.extend([(0.001, [(2, 1)], ())] * 300)  # hold the tab/shift mod-tap
+    frames.extend([(0.001, (), ())] * 20)
+
+    start = time.perf_counter()
+    sim.run(frames)
+    elapsed = time.perf_counter() - start
+    print("keyboard reports:", [keyboard_keys(r) for r in sim.keyboard.reports])
+    print("%d scans, %.1f us/scan" % (len(frames), elapsed / len(frames) * 1e6))
@@ -0,0 +1,301 @@
+from keys import Key, Sequence, ConsumerKey, MouseKey, MouseMove, ModTap, TapDance
+from combos import Combo
+from hid_codes import Keycode, ConsumerControlCode, Mouse
+
+# https://docs.circuitpython.org/projects/hid/en/latest/_modules/adafruit_hid/keycode.html
+
+# The pins we'll use, each will have an internal pullup
+row_pin_map = {
+    1: "GP22",
+    2: "GP13",
+    3: "GP14",
+    4: "GP15",
+}
+col_pin_map = {
+    1: "GP12",
+    2: "GP11",
+    3: "GP10",
+    4: "GP9",
+    5: "GP7",
+    6: "GP6",
+}
+
+# tx, rx of the link to the left half
+uart_pins = ("GP16", "GP17")
+
+# "digitalio" scans the matrix by hand every loop, "keypad" lets
+# keypad.KeyMatrix scan it in the background
+matrix_backend = "digitalio"
+
+# per-stage scan timing, type "s" on the serial console to print it; off
+# costs a few None checks per scan
+latency_stats = False
+target_scan_ms = 2
+
+# record raw matrix edges of both halves in a ring of this many entries (0 is
+# off), send "t" on the serial console to save it to trace_file (needs
+# boot.py's WRITABLE); a trace in replay_file is played back through the
+# keymap once at startup
+trace_size = 0
+trace_file = "/trace.txt"
+replay_file = None
+
+# garbage collection only once keys have been idle this long (or free memory
+# drops under gc_min_free bytes), None leaves it to CircuitPython
+gc_idle_ms = 50
+gc_min_free = 16384
+
+# how a tap-hold key (ModTap, TapDance) is decided when other keys are
+# pressed while it's down: "hold_on_other_key_press", "permissive_hold" or
+# "timeout" (see tap_hold.py); other keys always reach the host after it.
+# With retro_tap a tap-hold held past T on its own still taps on release.
+tap_hold_policy = "hold_on_other_key_press"
+retro_tap = False
+
+# keys of a combo have to go down within this many ms of each other
+combo_term_ms = 50
+
+# mouse keys (see mouse_keys.py): cursor speed in counts per second from
+# mouse_start_speed when pressed up to mouse_max_speed after
+# mouse_time_to_max_ms, along a curve (a whole number: 1 linear, 2
+# quadratic, ...); the wheel scrolls mouse_scroll_speed steps per second; one
+# report per mouse_report_ms
+mouse_start_speed = 200
+mouse_max_speed = 1600
+mouse_time_to_max_ms = 800
+mouse_curve = 2
+mouse_scroll_speed = 15
+mouse_report_ms = 10
+
+# n-key rollover keyboard report (boot.py sets up the device), any number of
+# keys down at once; off, it's the standard report with room for six
+nkro = True
+
+# debounce algorithm ("eager", "defer", "symmetric" or None) and window; the
+# left half is debounced here unless debounce_left is off (see left_half.py)
+debounce = "eager"
+debounce_ms = 5
+debounce_left = True
+
+# holding both the numbers and nav keys gives the "both" layer
+tri_layers = [(("numbers", "nav"), "both")]
+
+kc = Keycode
+cc = ConsumerControlCode
+
+
+def build_layers():
+    # keys grab their HID device when constructed, so keys.bind_devices() has
+    # to be called before this
+    return {
+        "base": {
+            "right": {
+                1: {
+                    1: Key(kc.MINUS),
+                    2: Key(kc.P),
+                    3: Key(kc.O),
+                    4: Key(kc.I),
+                    5: Key(kc.U),
+                    6: Key(kc.Y),
+                },
+                2: {
+                    1: Key(kc.LEFT_SHIFT),
+                    2: Key(kc.SEMICOLON),
+                    3: Key(kc.L),
+                    4: Key(kc.K),
+                    5: Key(kc.J),
+                    6: Key(kc.H),
+                },
+                3: {
+                    1: Key(kc.RETURN),
+                    2: Key(kc.FORWARD_SLASH),
+                    3: Key(kc.PERIOD),
+                    4: Key(kc.COMMA),
+                    5: Key(kc.M),
+                    6: Key(kc.N),
+                },
+                4: {
+                    4: Key(kc.SPACE),
+                    5: "numbers",
+                    6: TapDance(kc.RIGHT_CONTROL, [kc.RIGHT_ALT]),
+                },
+            },
+            "left": {
+                1: {
+                    1: Key(kc.EQUALS),
+                    2: Key(kc.Q),
+                    3: Key(kc.W),
+                    4: Key(kc.E),
+                    5: Key(kc.R),
+                    6: Key(kc.T),
+                },
+                2: {
+                    1: ModTap(kc.TAB, kc.LEFT_SHIFT),
+                    2: Key(kc.A),
+                    3: Key(kc.S),
+                    4: Key(kc.D),
+                    5: Key(kc.F),
+                    6: Key(kc.G),
+                },
+                3: {
+                    1: Key(kc.BACKSPACE),
+                    2: Key(kc.Z),
+                    3: Key(kc.X),
+                    4: Key(kc.C),
+                    5: Key(kc.V),
+                    6: Key(kc.B),
+                },
+                4: {
+                    4: Key(kc.LEFT_GUI),
+                    5: "nav",
+                    6: ModTap(kc.ESCAPE, kc.LEFT_CONTROL),
+                },
+            },
+        },
+        "numbers": {
+            "right": {
+                1: {
+                    1: ModTap(kc.BACKSLASH, [kc.BACKSLASH, kc.RIGHT_SHIFT], T=0.2),
+                    2: Key([kc.ZERO, kc.LEFT_SHIFT]),
+                    3: Key([kc.NINE, kc.LEFT_SHIFT]),
+                    4: Key([kc.EIGHT, kc.LEFT_SHIFT]),
+                    5: Key([kc.SEVEN, kc.LEFT_SHIFT]),
+                    6: Key([kc.SIX, kc.LEFT_SHIFT]),
+                },
+                2: {
+                    1: Key(kc.PERIOD),
+                    2: Key(kc.ZERO),
+                    3: Key(kc.NINE),
+                    4: Key(kc.EIGHT),
+                    5: Key(kc.SEVEN),
+                    6: Key(kc.SIX),
+                },
+                3: {
+                    2: Key(kc.RIGHT_BRACKET),
+                    3: Key(kc.LEFT_BRACKET),
+                    4: Key([kc.RIGHT_SHIFT, kc.RIGHT_BRACKET]),
+                    5: Key([kc.RIGHT_SHIFT, kc.LEFT_BRACKET]),
+                    6: Key(kc.SPACE),
+                },
+            },
+            "left": {
+                1: {
+                    1: Key(kc.GRAVE_ACCENT),
+                    2: Key([kc.LEFT_SHIFT, kc.ONE]),
+                    3: Key([kc.LEFT_SHIFT, kc.TWO]),
+                    4: Key([kc.LEFT_SHIFT, kc.THREE]),
+                    5: Key([kc.LEFT_SHIFT, kc.FOUR]),
+                    6: Key([kc.LEFT_SHIFT, kc.FIVE]),
+                },
+                2: {
+                    2: Key(kc.ONE),
+                    3: Key(kc.TWO),
+                    4: Key(kc.THREE),
+                    5: Key(kc.FOUR),
+                    6: Key(kc.FIVE),
+                },
+                3: {
+                    4: Key([kc.LEFT_SHIFT, kc.LEFT_CONTROL, kc.C]),
+                    5: Key([kc.LEFT_SHIFT, kc.LEFT_CONTROL, kc.V]),
+                },
+            },
+        },
+        "both": {
+            "right": {
+                1: {
+                    1: Key(kc.F11),
+                    2: Key(kc.F10),
+                    3: Key(kc.F9),
+                    4: Key(kc.F8),
+                    5: Key(kc.F7),
+                    6: Key(kc.F6),
+                },
+                2: {
+                    2: ConsumerKey(cc.SCAN_NEXT_TRACK),
+                    3: ConsumerKey(cc.PLAY_PAUSE),
+                    4: ConsumerKey(cc.VOLUME_INCREMENT),
+                    5: ConsumerKey(cc.VOLUME_DECREMENT),
+                    6: ConsumerKey(cc.MUTE),
+                },
+                3: {
+                    2: Key(kc.RIGHT_BRACKET),
+                    3: Key(kc.LEFT_BRACKET),
+                    4: Key([kc.RIGHT_SHIFT, kc.RIGHT_BRACKET]),
+                    5: Key([kc.RIGHT_SHIFT, kc.LEFT_BRACKET]),
+                    6: Key(kc.SPACE),
+                },
+            },
+            "left": {
+                1: {
+                    2: Key(kc.F1),
+                    3: Key(kc.F2),
+                    4: Key(kc.F3),
+                    5: Key(kc.F4),
+                    6: Key(kc.F5),
+                },
+                3: {
+                    3: Sequence([[kc.LEFT_CONTROL, kc.B], [kc.LEFT_CONTROL, kc.B], kc.P], delay=0.01),
+                    4: Sequence([[kc.LEFT_CONTROL, kc.B], kc.P], delay=0.01),
+                    5: Sequence([[kc.LEFT_CONTROL, kc.B], kc.N], delay=0.01),
+                    6: Sequence([[kc.LEFT_CONTROL, kc.B], [kc.LEFT_CONTROL, kc.B], kc.N], delay=0.01),
+                }
+            },
+        },
+        "nav": {
+            "right": {
+                1: {
+                    1: Key([kc.QUOTE, kc.RIGHT_SHIFT]),
+                    2: MouseKey(Mouse.LEFT_BUTTON),
+                    3: Key(kc.END),
+                    4: MouseMove(0, 0, 1),
+                    5: MouseMove(0, 0, -1),
+                    6: Key(kc.HOME),
+                },
+                2: {
+                    1: Key(kc.QUOTE),
+                    2: MouseKey(Mouse.RIGHT_BUTTON),
+                    3: Key(kc.RIGHT_ARROW),
+                    4: Key(kc.UP_ARROW),
+                    5: Key(kc.DOWN_ARROW),
+                    6: Key(kc.LEFT_ARROW),
+                },
+                3: {
+                    2: MouseKey(Mouse.MIDDLE_BUTTON),
+                    3: Key([kc.RIGHT_ARROW, kc.RIGHT_CONTROL]),
+                    4: Key([kc.RIGHT_ARROW, kc.RIGHT_ALT]),
+                    5: Key([kc.LEFT_ARROW, kc.RIGHT_ALT]),
+                    6: Key([kc.LEFT_ARROW, kc.RIGHT_CONTROL]),
+                },
+                4: {
+                    4: Key([kc.LEFT_GUI]),
+                },
+            },
+            "left": {
+                1: {
+                    1: Key([kc.LEFT_SHIFT, kc.GRAVE_ACCENT]),
+                    3: ModTap([kc.LEFT_CONTROL, kc.W], [kc.LEFT_CONTROL, kc.LEFT_SHIFT, kc.T], T=0.2),
+                    4: MouseMove(0, -1),
+                    6: Key([kc.LEFT_ALT, kc.UP_ARROW]),
+                },
+                2: {
+                    2: Key(kc.LEFT_ALT),
+                    3: MouseMove(-1, 0),
+                    4: MouseMove(0, 1),
+                    5: MouseMove(1, 0),
+                    6: Key([kc.LEFT_ALT, kc.DOWN_ARROW]),
+                },
+                3: {
+                    4: Key([kc.LEFT_CONTROL, kc.LEFT_SHIFT, kc.TAB]),
+                    5: Key([kc.LEFT_CONTROL, kc.TAB]),
+                },
+            },
+        },
+    }
+
+
+def build_combos():
+    # chords of keys, on one half or across both, that act as one key (see
+    # combos.py); keys are (side, row, col) as in build_layers(), e.g.
+    #   Combo([("left", 2, 4), ("left", 2, 5)], Key(kc.ESCAPE))
+    # or {layer: action} for a different action per layer
+    return []
@@ -0,0 +1,111 @@
+import binascii
+import sys
+
+import keys
+import keymap
+from firmware import Firmware
+from host_sim import HostBackend
+
+# Compiles keymap.py into keymap_compiled.py, run on a PC: `make compile`.
+# The keymap is built and flattened once here, the way Firmware does it at
+# boot, and written out as flat tables:
+#
+#   SOURCE_CRC   crc32 of keymap.py, code.py ignores the tables if it doesn't
+#                match the keymap.py next to it
+#   ACTIONS      every distinct keymap entry as a tuple (see keys.KINDS),
+#                index 0 is "no key"
+#   KEYS         per layer, (left, right) bytes of action indices, one per key
+#   LAYER_KEYS   (side, key index) of the base layer's layer keys
+#   COMBOS       (left key mask, right key mask) per combo, their actions are
+#                in KEYS after the right half's keys
+#
+# code.py uses keymap_compiled.py when it's there and was compiled from the
+# same keymap.py, so rerun this after editing keymap.py (make code does).
+
+HEADER = """\
+# Generated by keymap_compiler.py from keymap.py, don't edit; rerun
+# `make compile` after changing the keymap.
+"""
+
+
+def tupled(value):
+    if isinstance(value, (list, tuple)):
+        return tuple(tupled(v) for v in value)
+    return value
+
+
+def source_crc(path):
+    with open(path, "rb") as f:
+        return binascii.crc32(f.read())
+
+
+def compile_keymap(fw, crc):
+    # source of the compiled module for a Firmware built from layers_dict,
+    # crc is source_crc() of the keymap.py it was built from
+    actions = [None]
+    index = {None: 0}
+
+    def action_index(val):
+        action = tupled(keys.action_of(val))
+        if action not in index:
+            if len(actions) == 256:
+                raise ValueError("more than 255 distinct keys, KEYS is bytes")
+            index[action] = len(actions)
+            actions.append(action)
+        return index[action]
+
+    layer_names = list(fw.layers_dict)
+    key_tables = []
+    for name in layer_names:
+        sides = fw.layers[name]
+        key_tables.append(
+            tuple(
+                bytes(action_index(val) for val in sides[side])
+                for side in ("left", "right")
+            )
+        )
+
+    layer_keys = []
+    for side in ("left", "right"):
+        for idx in fw.layer_info[side].values():
+            layer_keys.append((side, idx))
+
+    lines = [HEADER]
+    lines.append("LAYER_NAMES = %r" % (tuple(layer_names),))
+    lines.append("N_KEYS = %d" % fw.n_keys)
+    lines.append("SOURCE_CRC = 0x%08x" % crc)
+    lines.append("ACTIONS = (")
+    for action in actions:
+        lines.append("    %r," % (action,))
+    lines.append(")")
+    lines.append("KEYS = (")
+    for name, (left, right) in zip(layer_names, key_tables):
+        lines.append("    # %s" % name)
+        lines.append("    (%r, %r)," % (left, right))
+    lines.append(")")
+    lines.append("LAYER_KEYS = %r" % (tuple(sorted(layer_keys)),))
+    masks = fw.combos.masks if fw.combos is not None else ()
+    lines.append("COMBOS = %r" % (tuple(masks),))
+    return "\n".join(lines) + "\n"
+
+
+def build_firmware():
+    backend = HostBackend()
+    keys.bind_devices(*backend.hid_devices())
+    return Firmware(
+        backend,
+        keymap.build_layers(),
+        keymap.row_pin_map,
+        keymap.col_pin_map,
+        keymap.uart_pins,
+        keymap.tri_layers,
+        combos=keymap.build_combos(),
+    )
+
+
+if __name__ == "__main__":
+    path = sys.argv[1] if len(sys.argv) > 1 else "keymap_compiled.py"
+    source = compile_keymap(build_firmware(), source_crc(keymap.__file__))
+    with open(path, "w") as f:
+        f.write(source)
+    print("wrote", path)
@@ -0,0 +1,310 @@
+from state_machine import (
+    StateMachine,
+    StartState,
+    WaitState,
+    KeyPressState,
+    KeyTapState,
+    KeySequenceState,
+)
+from layers import Toggle
+
+# HID devices the keys send to, set by bind_devices() before the keymap is
+# built (adafruit_hid objects on the board, host_sim stand-ins on a PC)
+keyboard = None
+mouse = None
+concon = None
+
+
+def bind_devices(kb, ms, cc):
+    global keyboard, mouse, concon
+    keyboard = kb
+    mouse = ms
+    concon = cc
+
+
+# start states hold no per-key state, so every Sequence shares one
+SEQ_START = StartState("Start", "key_seq")
+
+
+class Key:
+    # Plain keys have no state machine: the scan loop calls press() and
+    # release() straight from the key's edges and remembers which entry it
+    # pressed until the key goes up.
+    plain = True
+
+    def __init__(self, kc):
+        self.kb = keyboard
+        self.kc = kc  # keycode?
+        self.codes = tuple(kc) if isinstance(kc, list) else (kc,)
+
+    def __repr__(self):
+        return f"{self.kc}"
+
+    def action(self):
+        return ("key", self.kc)
+
+    def press(self):
+        try:
+            self.kb.press(*self.codes)
+        except ValueError:
+            print("more than 6?")
+        except OSError:
+            print("os error")
+
+    def release(self):
+        try:
+            self.kb.release(*self.codes)
+        except OSError:
+            print("os error?")
+
+    @property
+    def type(self):
+        return "keyseq"
+
+
+class Sequence:
+    plain = False
+
+    def __init__(self, kc_list, delay=0.1):
+        self.kb = keyboard
+        self.kc = kc_list
+        self.delay = delay
+
+        self.sm = StateMachine(
+            {
+                "start": SEQ_START,
+                "key_seq": KeySequenceState(
+                    "Seq", self.kb, self.kc, "start", delay=delay
+                ),
+            }
+        )
+
+    def __repr__(self):
+        return f"{self.kc}"
+
+    def action(self):
+        return ("seq", self.kc, self.delay)
+
+    def update(self, val, now):
+        self.sm.update(val, now)
+
+    @property
+    def type(self):
+        return "key"
+
+
+class ConsumerKey(Key):
+    def __init__(self, kc):
+        Key.__init__(self, kc)
+        self.kb = concon
+
+    def action(self):
+        return ("cc", self.kc)
+
+    def release(self):
+        try:
+            self.kb.release()
+        except OSError:
+            print("os error?")
+
+    @property
+    def type(self):
+        return "cckey"
+
+
+class MouseKey(Key):
+    def __init__(self, kc):
+        Key.__init__(self, kc)
+        self.kb = mouse
+
+    def action(self):
+        return ("mouse", self.kc)
+
+    @property
+    def type(self):
+        return "mousekey"
+
+
+class MouseMove:
+    # Plain as well: holding it only adds its direction to the mouse-key
+    # engine (mouse_keys.py), which moves the cursor on the scan clock.
+    # dx, dy, dw: direction, usually -1, 0 or 1, scaled by the engine's speed
+    plain = True
+
+    def __init__(self, dx, dy, dw=0):
+        self.dx = dx
+        self.dy = dy
+        self.dw = dw
+        self.engine = None  # set by Firmware
+
+    def __repr__(self):
+        return f"MouseMove({self.dx}, {self.dy}, {self.dw})"
+
+    def action(self):
+        return ("move", self.dx, self.dy, self.dw)
+
+    def press(self):
+        self.engine.hold(self.dx, self.dy, self.dw)
+
+    def release(self):
+        self.engine.let_go(self.dx, self.dy, self.dw)
+
+    @property
+    def type(self):
+        return "mousemove"
+
+
+class ModTap:
+    plain = False
+
+    def __init__(self, kc1, kc2, T=0.2, taptap=False, permissive_hold=True):
+        kb = keyboard
+        act2 = (
+            KeyPressState("Act2Press", kb, kc2, "start")
+            if not taptap
+            else KeyTapState("Act2Tap", kb, kc2, "start")
+        )
+        self.sm = StateMachine(
+            {
+                "start": StartState("Start", "act1wait"),
+                "act1wait": WaitState(
+                    "Act1Wait1",
+                    T,
+                    "act2press",
+                    "act1tap",
+                    success_on_permissive_hold=permissive_hold,
+                ),
+                "act1tap": KeyTapState("Act1Tap", kb, kc1, "start"),
+                "act2press": act2,
+            }
+        )
+        self.kc1 = kc1
+        self.kc2 = kc2
+        self.T = T
+        self.taptap = taptap
+        self.permissive_hold = permissive_hold
+
+    def retro_tap(self):
+        # tap kc1 after all, for a hold that ended without another key
+        codes = self.kc1 if isinstance(self.kc1, list) else [self.kc1]
+        keyboard.press(*codes)
+        keyboard.release(*codes)
+
+    def action(self):
+        return (
+            "modtap",
+            self.kc1,
+            self.kc2,
+            self.T,
+            self.taptap,
+            self.permissive_hold,
+        )
+
+    def update(self, val, now):
+        self.sm.update(val, now)
+
+    @property
+    def type(self):
+        return "modtap"
+
+
+class TapDance:
+    plain = False
+
+    def __init__(self, kc1, kc2, kc1hold=None, kc2hold=None, T=0.2):
+        kb = keyboard
+        self.kb = kb
+        self.kc1 = kc1
+        self.kc2 = kc2
+        self.kc1hold = kc1 if kc1hold is None else kc1hold
+        self.kc2hold = kc2 if kc2hold is None else kc2hold
+        self.T = T
+
+        self.sm = StateMachine(
+            {
+                "start": StartState("Start", "act1wait"),
+                "act1wait": WaitState(
+                    "Act1Wait1",
+                    T,
+                    "act1press",
+                    "act1tapwait",
+                    success_on_permissive_hold=True,
+                ),
+                "act1tapwait": WaitState(
+                    "Act1Wait2",
+                    T,
+                    "act1tap",
+                    "act2wait",
+                    inverted=True,
+                    success_on_permissive_hold=True,
+                ),
+                "act1press": KeyPressState("Act1Press", self.kb, self.kc1hold, "start"),
+                "act1tap": KeyTapState("Act1Tap", self.kb, self.kc1, "start"),
+                "act2wait": WaitState(
+                    "Act2Wait1",
+                    T,
+                    "act2press",
+                    "act2tap",
+                    success_on_permissive_hold=True,
+                ),
+                # "act2tapwait": WaitState(
+                #     "Act2Wait2",
+                #     T,
+                #     "act2tap",
+                #     "start",
+                #     inverted=True,
+                #     success_on_permissive_hold=True,
+                # ),
+                "act2press": KeyPressState("Act2Press", self.kb, self.kc2hold, "start"),
+                "act2tap": KeyTapState("Act2Tap", self.kb, self.kc2, "start"),
+            }
+        )
+
+    @property
+    def type(self):
+        return "tapdance"
+
+    def action(self):
+        return ("tapdance", self.kc1, self.kc2, self.kc1hold, self.kc2hold, self.T)
+
+    def update(self, val, now):
+        self.sm.update(val, now)
+
+
+# Keymap entries as plain tuples, for the precompiled keymap (see
+# keymap_compiler.py): (kind, constructor args...), lists of keycodes as tuples.
+KINDS = {
+    "key": Key,
+    "seq": Sequence,
+    "cc": ConsumerKey,
+    "mouse": MouseKey,
+    "move": MouseMove,
+    "modtap": ModTap,
+    "tapdance": TapDance,
+    "layer": str,
+    "toggle": Toggle,
+}
+
+
+def action_of(val):
+    # keymap entry -> action tuple
+    if val is None:
+        return None
+    if isinstance(val, str):
+        return ("layer", val)
+    if isinstance(val, Toggle):
+        return ("toggle", val.layer)
+    return val.action()
+
+
+def _listed(arg):
+    if isinstance(arg, tuple):
+        return [_listed(a) for a in arg]
+    return arg
+
+
+def from_action(action):
+    # action tuple -> a fresh keymap entry, needs bind_devices() first
+    if action is None:
+        return None
+    return KINDS[action[0]](*[_listed(arg) for arg in action[1:]])
@@ -0,0 +1,118 @@
+from array import array
+
+# Matrix trace recording and replay. The recorder keeps the raw (pre-debounce)
+# press/release edges of both halves in a fixed ring in RAM: a 32-bit wrapping
+# microsecond timestamp and one code byte per edge, the oldest overwritten
+# once it's full. Nothing is recorded on scans where no key changed.
+#
+# A trace is a list of (us since the first edge, side, key index, down)
+# tuples, from TraceRecorder.entries() or load(). Firmware.replay() feeds it
+# back through debounce, layers and the state machines on a virtual clock, so
+# a tap/hold misfire can be reproduced on the board or in host_sim.
+#
+# Files are one edge per line, "<us> <left|right> <key index> <1|0>". The
+# board can only write them if boot.py has remounted the filesystem writable.
+
+LEFT = 0x80
+DOWN = 0x40
+INDEX = 0x3F
+WRAP = 0xFFFFFFFF
+
+
+class TraceRecorder:
+    def __init__(self, n_keys, size=1024):
+        self.size = size
+        self.times = array("L", [0] * size)
+        self.codes = bytearray(size)  # LEFT | DOWN | key index
+        self.head = 0  # next slot to write
+        self.count = 0
+        self.prev = {"left": 0, "right": 0}
+        self.bit_index = {1 << idx: idx for idx in range(n_keys)}
+
+    def record(self, side, bits, now):
+        # raw key bitmask of one half and scan time in ns
+        changed = bits ^ self.prev[side]
+        if not changed:
+            return
+        self.prev[side] = bits
+        stamp = (now // 1000) & WRAP
+        code = LEFT if side == "left" else 0
+        bit_index = self.bit_index
+        while changed:
+            bit = changed & -changed
+            changed ^= bit
+            head = self.head
+            self.times[head] = stamp
+            self.codes[head] = code | (DOWN if bits & bit else 0) | bit_index[bit]
+            self.head = (head + 1) % self.size
+            if self.count < self.size:
+                self.count += 1
+
+    def clear(self):
+        self.head = 0
+        self.count = 0
+
+    def entries(self):
+        # oldest first, timestamps unwrapped relative to the first edge
+        entries = []
+        first = (self.head - self.count) % self.size
+        t = 0
+        last = self.times[first]
+        for i in range(self.count):
+            j = (first + i) % self.size
+            t += (self.times[j] - last) & WRAP
+            last = self.times[j]
+            code = self.codes[j]
+            side = "left" if code & LEFT else "right"
+            entries.append((t, side, code & INDEX, 1 if code & DOWN else 0))
+        return entries
+
+    def save(self, path):
+        with open(path, "w") as f:
+            for t, side, idx, down in self.entries():
+                f.write("%d %s %d %d\n" % (t, side, idx, down))
+
+
+def load(path):
+    entries = []
+    with open(path) as f:
+        for line in f:
+            fields = line.split()
+            if len(fields) == 4:
+                entries.append(
+                    (int(fields[0]), fields[1], int(fields[2]), int(fields[3]))
+                )
+    return entries
+
+
+def replay_ns(entries, tail_ns=1000000000):
+    # length of a replay_scans() run
+    if not entries:
+        return 0
+    return entries[-1][0] * 1000 + tail_ns
+
+
+def replay_scans(entries, scan_ns=1000000, tail_ns=1000000000):
+    # (ns since the first edge, left bits, right bits) for every replayed
+    # scan: one at each recorded edge time and every scan_ns in between, then
+    # tail_ns more so holds and timeouts left at the end can resolve. A trace
+    # cut by the ring starts with every key up.
+    if not entries:
+        return
+    bits = {"left": 0, "right": 0}
+    end = replay_ns(entries, tail_ns)
+    i = 0
+    t = 0
+    while t <= end:
+        while i < len(entries) and entries[i][0] * 1000 <= t:
+            _, side, idx, down = entries[i]
+            if down:
+                bits[side] |= 1 << idx
+            else:
+                bits[side] &= ~(1 << idx)
+            i += 1
+        yield t, bits["left"], bits["right"]
+        step = t + scan_ns
+        if i < len(entries) and entries[i][0] * 1000 < step:
+            step = entries[i][0] * 1000
+        t = step
@@ -0,0 +1,93 @@
+# Layer resolution. Layer keys and the rules between layers are compiled at
+# startup into a table indexed by the bitmask of active layers, so picking
+# the layer each scan is a table lookup whatever the number of layers.
+#
+# In layers_dict a layer key is the name of the layer it holds (momentary),
+# or Toggle(name) to switch the layer on/off with each press. Tri-layer rules
+# are ((layer, layer, ...), target) pairs: with all of the layers on, target
+# is on too.
+
+
+class Toggle:
+    def __init__(self, layer):
+        self.layer = layer
+
+    def __repr__(self):
+        return f"Toggle({self.layer})"
+
+
+def layer_key_target(val):
+    # name of the layer a keymap entry switches to, None for ordinary keys
+    if isinstance(val, str):
+        return val
+    if isinstance(val, Toggle):
+        return val.layer
+    return None
+
+
+class LayerEngine:
+    def __init__(self, layer_names, layer_keys, tri_layers=(), priorities=None):
+        # layer_names: all layers, in layers_dict order, "base" included
+        # layer_keys: (side, idx, keymap entry) for every layer key
+        # priorities: layer names, highest first; by default tri-layer targets
+        #   win over anything else, then later layers in layers_dict win
+        self.base = "base"
+        switchable = []
+        for _, _, val in layer_keys:
+            name = layer_key_target(val)
+            if name not in layer_names:
+                raise ValueError(f"layer key for unknown layer {name}")
+            if name not in switchable:
+                switchable.append(name)
+        bit_of = {name: 1 << i for i, name in enumerate(switchable)}
+
+        # (key mask, layer bit) per side for held keys, toggles apart
+        self.momentary = {"left": [], "right": []}
+        self.toggles = {"left": [], "right": []}
+        self.layer_key_mask = {"left": 0, "right": 0}
+        for side, idx, val in layer_keys:
+            entry = (1 << idx, bit_of[layer_key_target(val)])
+            if isinstance(val, Toggle):
+                self.toggles[side].append(entry)
+            else:
+                self.momentary[side].append(entry)
+            self.layer_key_mask[side] |= 1 << idx
+        self.toggled = 0
+
+        if priorities is None:
+            targets = [target for _, target in tri_layers]
+            priorities = targets + [
+                name for name in reversed(layer_names) if name not in targets
+            ]
+        rank = {name: i for i, name in enumerate(priorities)}
+
+        table = []
+        for active in range(1 << len(switchable)):
+            on = set(name for name in switchable if active & bit_of[name])
+            for needed, target in tri_layers:
+                if all(name in on for name in needed):
+                    on.add(target)
+            best = self.base
+            best_rank = len(rank)
+            for name in on:
+                if rank.get(name, len(rank)) < best_rank:
+                    best = name
+                    best_rank = rank[name]
+            table.append(best)
+        self.table = tuple(table)
+
+    def resolve(self, state, pressed):
+        # active layer for the per-side key state/pressed-edge masks
+        active = 0
+        for side in ("left", "right"):
+            held = state[side] & self.layer_key_mask[side]
+            if not held:
+                continue
+            for key_mask, layer_bit in self.momentary[side]:
+                if held & key_mask:
+                    active |= layer_bit
+            if pressed[side] & held:
+                for key_mask, layer_bit in self.toggles[side]:
+                    if pressed[side] & key_mask:
+                        self.toggled ^= layer_bit
+        return self.table[active | self.toggled]
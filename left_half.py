@@ -1,88 +1,70 @@
-import time
-import board
-import busio
-import digitalio
-import time
+from hal import CircuitPythonBackend
+from matrix import MatrixScanner, KeypadScanner
+from debounce import Debouncer
+from left_scanner import LeftScanner
 
-led = digitalio.DigitalInOut(board.LED)
-led.direction = digitalio.Direction.OUTPUT
+# debounce on this board, e.g. ("eager", 5), instead of on the right half
+# (turn keymap.debounce_left off then)
+DEBOUNCE = None
 
-led.value = True
-
-uart = busio.UART(board.GP01, board.GP13, baudrate=115200)
-
-ctr = 0
-start = time.monotonic()
-output = 1000
+# "digitalio" scans the matrix by hand every step, "keypad" lets
+# keypad.KeyMatrix scan it in the background
+MATRIX_BACKEND = "digitalio"
 
-import time
-import board
-import digitalio
+# print scans/s every left_scanner.STAT_EVERY scans (blocks on USB serial)
+DEBUG = False
 
-import struct
+# seconds between frames while keys are down / when idle
+ACTIVE_INTERVAL = 0
+IDLE_INTERVAL = 0.5
 
 row_pin_map = {
-    3: board.GP14,
-    4: board.GP15,
-    2: board.GP6,
-    1: board.GP8,
+    3: "GP14",
+    4: "GP15",
+    2: "GP6",
+    1: "GP8",
 }
 col_pin_map = {
-    6: board.GP16,
-    5: board.GP17,
-    3: board.GP28,
-    2: board.GP21,
-    1: board.GP20,
-    4: board.GP27,
+    6: "GP16",
+    5: "GP17",
+    3: "GP28",
+    2: "GP21",
+    1: "GP20",
+    4: "GP27",
 }
 
-row_pins = []
-col_pins = []
-
-for idx, pin in col_pin_map.items():
-    key_pin = digitalio.DigitalInOut(pin)
-    key_pin.direction = digitalio.Direction.INPUT
-    key_pin.pull = digitalio.Pull.UP
-    col_pins.append(key_pin)
-
-for idx, pin in row_pin_map.items():
-    key_pin = digitalio.DigitalInOut(pin)
-    key_pin.direction = digitalio.Direction.OUTPUT
-    key_pin.value = True
-    row_pins.append(key_pin)
-
-counter = 0
-prev_time = time.monotonic()
+backend = CircuitPythonBackend()
 
+led = backend.output_pin("LED")
+led.value = True
 
-arr = [b"0"]*(len(row_pins)*len(col_pins))
-arr.append(b"\n")
-
-print(len(arr))
+uart = backend.uart("GP01", "GP13", baudrate=115200)
+
+if MATRIX_BACKEND == "keypad":
+    scanner = KeypadScanner(
+        backend.key_matrix(list(row_pin_map.values()), list(col_pin_map.values())),
+        backend.key_event(),
+    )
+elif MATRIX_BACKEND == "digitalio":
+    col_pins = [backend.input_pin(pin) for pin in col_pin_map.values()]
+    row_pins = [backend.output_pin(pin) for pin in row_pin_map.values()]
+    scanner = MatrixScanner(row_pins, col_pins)
+else:
+    raise ValueError(f"unknown matrix backend {MATRIX_BACKEND}")
+
+debouncer = None
+if DEBOUNCE is not None:
+    debouncer = Debouncer(scanner.n_keys, *DEBOUNCE)
+
+left = LeftScanner(
+    scanner,
+    uart,
+    backend,
+    debouncer=debouncer,
+    active_interval=ACTIVE_INTERVAL,
+    idle_interval=IDLE_INTERVAL,
+    debug=DEBUG,
+)
 
 while True:
-    i = 0
-    for row, (row_idx, row_name) in zip(row_pins, row_pin_map.items()):
-        row.value = False
-        for col, (col_idx, col_name) in zip(col_pins, col_pin_map.items()):
-            
-            out = not col.value
-            if out:
-                arr[i] = b"1"
-            else:
-                arr[i] = b"0"
-
-                pass
-            i += 1
-
-        row.value = True
-    to_write = b"".join(arr)
-    print(to_write)
-    oot = uart.write(to_write)
-
-    ctr += 1
-    if ctr % 100 == 0:
-        print(time.monotonic() - start)
-        start = time.monotonic()
-        
-    #time.sleep(23/1000)
\ No newline at end of file
+    left.step()
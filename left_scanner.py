@@ -0,0 +1,100 @@
+import split_link
+
+# The left half's scan engine: scan the matrix, optionally debounce, and send
+# frames to the right half. Frames are built in preallocated buffers and
+# nothing is printed unless debug is on.
+#
+# Transmit rate adapts to activity: while keys are down or changing, frames
+# (or, with split_link.EVENTS, keyframes) go out every active_interval
+# seconds; once everything is up, and a keyframe has gone out since the last
+# change, they slow down to idle_interval. With events, key changes
+# themselves are always sent straight away, and that keyframe is what fixes
+# a lost release.
+
+STAT_EVERY = 100
+
+
+class LeftScanner:
+    def __init__(
+        self,
+        scanner,
+        uart,
+        clock,
+        debouncer=None,
+        active_interval=0,
+        idle_interval=0.5,
+        debug=False,
+    ):
+        self.scanner = scanner
+        self.uart = uart
+        self.clock = clock
+        self.debouncer = debouncer
+        self.debug = debug
+        self.events = split_link.EVENTS
+        if self.events:
+            active_interval = max(active_interval, split_link.KEYFRAME_INTERVAL)
+            idle_interval = max(idle_interval, split_link.KEYFRAME_INTERVAL)
+        self.active_interval = int(active_interval * 1000000000)
+        self.idle_interval = int(idle_interval * 1000000000)
+
+        self.frame = bytearray(split_link.FRAME_LEN)
+        self.event_frame = bytearray(split_link.EVENT_LEN)
+        self.bit_index = {1 << idx: idx for idx in range(scanner.n_keys)}
+        self.seq = 0
+        self.bits = 0
+        self.last_sent = None
+        self.unsent = False  # changed since the last state frame
+
+        # stats
+        self.scans = 0
+        self.frames_sent = 0
+        self.scans_per_second = 0.0
+        self.stat_started = clock.monotonic_ns()
+
+    def send_state(self, bits, now):
+        self.seq += 1
+        self.uart.write(split_link.encode_state(bits, self.seq, self.frame))
+        self.frames_sent += 1
+        self.last_sent = now
+        self.unsent = False
+
+    def send_events(self, bits, changed):
+        frame = self.event_frame
+        bit_index = self.bit_index
+        while changed:
+            bit = changed & -changed
+            changed ^= bit
+            self.seq += 1
+            split_link.encode_event(bit_index[bit], bits & bit, self.seq, frame)
+            self.uart.write(frame)
+            self.frames_sent += 1
+
+    def step(self):
+        now = self.clock.monotonic_ns()
+        self.scanner.scan()
+        bits = self.scanner.bits
+        if self.debouncer is not None:
+            bits = self.debouncer.update(bits, now)
+        changed = bits ^ self.bits
+        self.bits = bits
+        if changed:
+            self.unsent = True
+
+        interval = self.active_interval if bits or self.unsent else self.idle_interval
+        due = self.last_sent is None or now - self.last_sent >= interval
+        if self.events:
+            if changed:
+                self.send_events(bits, changed)
+            if due:
+                self.send_state(bits, now)
+        elif changed or due:
+            self.send_state(bits, now)
+
+        self.scans += 1
+        if self.scans % STAT_EVERY == 0:
+            elapsed = now - self.stat_started
+            if elapsed > 0:
+                self.scans_per_second = STAT_EVERY * 1000000000 / elapsed
+            self.stat_started = now
+            if self.debug:
+                print(self.scans_per_second, self.frames_sent)
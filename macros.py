@@ -0,0 +1,54 @@
+# Macro playback spread over scans. A Sequence queues its steps here instead
+# of pressing them inline with time.sleep() in between, and the scan loop
+# calls tick() once per scan to send whatever is due, so the keyboard keeps
+# scanning while a macro plays. Macros play one after the other in the order
+# they were queued; pressing a Sequence key again while its macro is still
+# queued cancels the rest of it (see state_machine.KeySequenceState).
+
+
+class MacroPlayer:
+    def __init__(self):
+        self.queue = []  # [kb, steps, next step, delay], oldest first
+        self.ready_at = 0  # ns, when the next step may go out
+
+    def play(self, kb, steps, delay):
+        # steps: keycodes or lists of keycodes, each pressed and released in
+        # turn with `delay` ns after it. Returns a handle for cancel().
+        macro = [kb, steps, 0, delay]
+        self.queue.append(macro)
+        return macro
+
+    def cancel(self, macro):
+        # drops the steps of `macro` that haven't gone out yet, each step
+        # releases its own keys so nothing stays down. True if it was still
+        # queued.
+        for i in range(len(self.queue)):
+            if self.queue[i] is macro:
+                del self.queue[i]
+                return True
+        return False
+
+    def tick(self, now):
+        # at most one step per scan, so each step gets its own HID report
+        queue = self.queue
+        if queue and now >= self.ready_at:
+            macro = queue[0]
+            kb, steps, i, delay = macro
+            kc = steps[i]
+            try:
+                if isinstance(kc, list):
+                    kb.press(*kc)
+                    kb.release(*kc)
+                else:
+                    kb.press(kc)
+                    kb.release(kc)
+            except ValueError:
+                print("more than 6?")
+            except OSError:
+                print("os error")
+            self.ready_at = now + delay
+            i += 1
+            if i < len(steps):
+                macro[2] = i
+            else:
+                queue.pop(0)
@@ -0,0 +1,56 @@
+# Matrix scanning. The scan table is built once at startup so the hot loop
+# doesn't rebuild zip()/items() iterators or keep its own index counter. Key
+# state is an integer bitmask, bit i set while key i is down.
+
+
+class MatrixScanner:
+    def __init__(self, row_pins, col_pins):
+        n_cols = len(col_pins)
+        self.table = tuple(
+            (row, tuple((col, 1 << (i * n_cols + j)) for j, col in enumerate(col_pins)))
+            for i, row in enumerate(row_pins)
+        )
+        self.n_keys = len(row_pins) * n_cols
+        self.bits = 0
+
+    def scan(self):
+        # Reads the matrix into self.bits. Edges aren't returned, the
+        # firmware works them out from the bits after debounce and combos.
+        bits = 0
+        for row, cols in self.table:
+            row.value = False
+            for col, mask in cols:
+                if not col.value:
+                    bits |= mask
+            row.value = True
+        self.bits = bits
+
+
+class KeypadScanner:
+    # Same interface as MatrixScanner on top of CircuitPython's keypad.KeyMatrix,
+    # which scans in the background in C and queues timestamped events; scan()
+    # only drains that queue. Key numbers are row * columns + column, the
+    # same order MatrixScanner uses.
+    def __init__(self, key_matrix, event):
+        self.key_matrix = key_matrix
+        self.event = event
+        self.n_keys = key_matrix.key_count
+        self.bits = 0
+        self.timestamp = 0  # ms, of the last event
+
+    def scan(self):
+        events = self.key_matrix.events
+        event = self.event
+        bits = self.bits
+        while events.get_into(event):
+            if event.pressed:
+                bits |= 1 << event.key_number
+            else:
+                bits &= ~(1 << event.key_number)
+            self.timestamp = event.timestamp
+        if events.overflowed:
+            # events got lost, start over from what the keys read now
+            events.clear()
+            self.key_matrix.reset()
+            bits = 0
+        self.bits = bits
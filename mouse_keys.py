@@ -0,0 +1,112 @@
+# Mouse keys driven by the scan clock. MouseMove keys only say which way they
+# point while they're held; the scan loop calls tick() and every report_ms
+# this sends one mouse.move() for all of them together, the distance worked
+# out from the time since the last one. How fast the cursor goes therefore
+# depends on how long the keys have been held, not on how often we scan:
+#
+#   speed = start + (max - start) * (held / time_to_max) ** curve
+#
+# in counts per second, capped at max once time_to_max has passed (curve is
+# a whole number: 1 ramps linearly, 2 starts slower and catches up). The wheel scrolls at a
+# fixed rate. The first report goes out in the scan the first key goes down,
+# so a tap still nudges the cursor / scrolls one step.
+#
+# Integer maths throughout: speeds in counts per second, times in us, and
+# the part of a count not sent yet carried over in millionths of a count.
+
+ONE = 1000000
+RAMP = 1024  # fixed point for held / time_to_max
+MAX_STEP_US = 100000  # a stalled loop doesn't make the cursor jump
+
+
+class MouseKeys:
+    def __init__(
+        self,
+        mouse,
+        start_speed=200,
+        max_speed=1600,
+        time_to_max_ms=800,
+        curve=2,
+        scroll_speed=15,
+        report_ms=10,
+    ):
+        self.mouse = mouse
+        self.start_speed = start_speed
+        self.max_speed = max_speed
+        self.time_to_max = max(1, int(time_to_max_ms * 1000))
+        if not isinstance(curve, int) or curve < 0:
+            raise ValueError(f"mouse curve must be a whole number, not {curve}")
+        self.curve = curve
+        self.scroll_speed = scroll_speed
+        self.report_us = int(report_ms * 1000)
+        self.held = 0  # MouseMove keys down
+        self.x = self.y = self.wheel = 0  # summed directions of those keys
+        self.started = -1  # ns the first of them went down, -1 until ticked
+        self.last = 0  # ns of the last report
+        self.rest_x = self.rest_y = self.rest_wheel = 0
+
+    def hold(self, dx, dy, dw):
+        self.held += 1
+        self.x += dx
+        self.y += dy
+        self.wheel += dw
+
+    def let_go(self, dx, dy, dw):
+        self.held -= 1
+        self.x -= dx
+        self.y -= dy
+        self.wheel -= dw
+        if not self.held:
+            self.started = -1
+
+    def speed(self, held):
+        # counts per second after `held` us
+        if held >= self.time_to_max:
+            return self.max_speed
+        ramp = held * RAMP // self.time_to_max
+        f = RAMP
+        for _ in range(self.curve):
+            f = f * ramp // RAMP
+        return self.start_speed + (self.max_speed - self.start_speed) * f // RAMP
+
+    def tick(self, now):
+        # once per scan while a MouseMove key is held
+        if self.started < 0:
+            # first scan of a move: a report's worth of travel right away,
+            # and a whole step of the wheel so a tap always scrolls
+            self.started = now
+            self.last = now - self.report_us * 1000
+            self.rest_x = self.rest_y = self.rest_wheel = 0
+            wheel = self.wheel
+        else:
+            wheel = 0
+        step = (now - self.last) // 1000
+        if step < self.report_us:
+            return
+        if step > MAX_STEP_US:
+            step = MAX_STEP_US
+        self.last = now
+
+        travel = self.speed((now - self.started) // 1000) * step
+        rest_x = self.rest_x + self.x * travel
+        rest_y = self.rest_y + self.y * travel
+        rest_wheel = self.rest_wheel + self.wheel * self.scroll_speed * step
+        x = whole(rest_x)
+        y = whole(rest_y)
+        steps = whole(rest_wheel)
+        self.rest_x = rest_x - x * ONE
+        self.rest_y = rest_y - y * ONE
+        self.rest_wheel = rest_wheel - steps * ONE
+        wheel += steps
+        if x or y or wheel:
+            try:
+                self.mouse.move(x, y, wheel)
+            except OSError:
+                print("usb error?")
+
+
+def whole(rest):
+    # whole counts in a remainder of millionths, rounding towards zero
+    if rest >= 0:
+        return rest // ONE
+    return -(-rest // ONE)
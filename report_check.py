@@ -0,0 +1,81 @@
+import random
+import sys
+
+from hid_output import KeyboardReport, NkroReport
+from host_sim import SimHIDDevice, keyboard_keys
+
+# Host-side check that the n-key rollover report and the standard six-key
+# one tell the host the same thing, run with `python3 report_check.py
+# [runs]`. Random press/release/release_all calls with flushes in between go
+# to both, never more keys than the standard report has slots for, and the
+# keys held in each report they send have to match, report for report.
+
+MODIFIERS = list(range(0xE0, 0xE8))
+KEYCODES = list(range(0x04, 0x40)) + MODIFIERS
+
+
+def random_calls(rng, n):
+    # [(method, keycodes)], with "flush" between scans. A shadow standard
+    # report tracks its free slots, taps hold theirs until they're sent.
+    calls = []
+    shadow = KeyboardReport(SimHIDDevice())
+    down = []
+    for _ in range(n):
+        r = rng.random()
+        free = shadow.report[2:].count(0)
+        if r < 0.3:
+            call = ("flush", ())
+        elif r < 0.35:
+            call = ("release_all", ())
+            down = []
+        elif r < 0.7:
+            room = [kc for kc in KEYCODES if kc not in down]
+            if not free:
+                room = [kc for kc in room if kc in MODIFIERS]
+            if not room:
+                continue
+            pressed = rng.sample(room, min(rng.randint(1, 2), len(room)))
+            if len([kc for kc in pressed if kc not in MODIFIERS]) > free:
+                pressed = pressed[:1]
+            call = ("press", tuple(pressed))
+            down.extend(pressed)
+        elif down:
+            released = rng.sample(down, rng.randint(1, min(2, len(down))))
+            call = ("release", tuple(released))
+            down = [kc for kc in down if kc not in released]
+        else:
+            continue
+        getattr(shadow, call[0])(*call[1])
+        calls.append(call)
+    calls.append(("flush", ()))
+    calls.append(("flush", ()))
+    return calls
+
+
+def sent_keys(report_class, calls):
+    device = SimHIDDevice()
+    report = report_class(device)
+    for method, keycodes in calls:
+        getattr(report, method)(*keycodes)
+    return [tuple(sorted(keyboard_keys(r))) for r in device.reports]
+
+
+def check(runs=2000, calls_per_run=60, seed=0):
+    rng = random.Random(seed)
+    for run in range(runs):
+        calls = random_calls(rng, calls_per_run)
+        standard = sent_keys(KeyboardReport, calls)
+        nkro = sent_keys(NkroReport, calls)
+        if standard != nkro:
+            print("run %d differs" % run)
+            print("calls:   ", calls)
+            print("standard:", standard)
+            print("nkro:    ", nkro)
+            return False
+    print("%d runs, same keys from both reports" % runs)
+    return True
+
+
+if __name__ == "__main__":
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    sys.exit(0 if check(runs) else 1)
@@ -0,0 +1,197 @@
+# Framing for the left half -> right half UART link.
+#
+# A state frame is 5 bytes:
+#   header  high nibble 0xA (frame type), low nibble sequence number
+#   3 bytes key state, bit i set when key i is pressed (little endian)
+#   crc8    over the first 4 bytes (poly 0x07)
+#
+# An event frame is 3 bytes:
+#   header  high nibble 0xB, low nibble sequence number
+#   event   key index in the low 7 bits, top bit set for a press
+#   crc8    over the first 2 bytes
+#
+# With EVENTS on, the left half only sends event frames when keys change,
+# plus a state frame (keyframe) every KEYFRAME_INTERVAL seconds so the right
+# half resyncs after a lost event. Both halves must agree on EVENTS.
+
+EVENTS = True
+KEYFRAME_INTERVAL = 0.1
+
+FRAME_LEN = 5
+EVENT_LEN = 3
+STATE = 0xA0
+EVENT = 0xB0
+TYPE_MASK = 0xF0
+SEQ_MASK = 0x0F
+PRESS = 0x80
+
+
+def _crc_table():
+    table = bytearray(256)
+    for i in range(256):
+        crc = i
+        for _ in range(8):
+            crc = ((crc << 1) ^ 0x07) & 0xFF if crc & 0x80 else (crc << 1) & 0xFF
+        table[i] = crc
+    return bytes(table)
+
+
+CRC_TABLE = _crc_table()
+
+
+def crc8(data, start, end):
+    crc = 0
+    table = CRC_TABLE
+    for i in range(start, end):
+        crc = table[crc ^ data[i]]
+    return crc
+
+
+def encode_state(bits, seq, buf=None):
+    if buf is None:
+        buf = bytearray(FRAME_LEN)
+    buf[0] = STATE | (seq & SEQ_MASK)
+    buf[1] = bits & 0xFF
+    buf[2] = (bits >> 8) & 0xFF
+    buf[3] = (bits >> 16) & 0xFF
+    buf[4] = crc8(buf, 0, 4)
+    return buf
+
+
+def encode_event(idx, pressed, seq, buf=None):
+    if buf is None:
+        buf = bytearray(EVENT_LEN)
+    buf[0] = EVENT | (seq & SEQ_MASK)
+    buf[1] = idx | PRESS if pressed else idx
+    buf[2] = crc8(buf, 0, 2)
+    return buf
+
+
+def frame_len(header):
+    kind = header & TYPE_MASK
+    if kind == STATE:
+        return FRAME_LEN
+    if kind == EVENT:
+        return EVENT_LEN
+    return 0
+
+
+def decode_state(frame, offset=0):
+    # key bits of a good state frame, None if the type or checksum is off
+    if frame[offset] & TYPE_MASK != STATE:
+        return None
+    if crc8(frame, offset, offset + 4) != frame[offset + 4]:
+        return None
+    return frame[offset + 1] | (frame[offset + 2] << 8) | (frame[offset + 3] << 16)
+
+
+def decode_event(frame, offset=0):
+    # event byte of a good event frame, None if the type or checksum is off
+    if frame[offset] & TYPE_MASK != EVENT:
+        return None
+    if crc8(frame, offset, offset + 2) != frame[offset + 2]:
+        return None
+    return frame[offset + 1]
+
+
+class LinkReceiver:
+    # Non-blocking receiver for a mixed stream of state and event frames.
+    # poll() drains whatever the UART has into a preallocated ring buffer and
+    # reframes from where the last poll stopped, so a frame split across
+    # polls is picked up once the rest arrives. `bits` always holds the most
+    # recent complete left-half state.
+    #
+    # Counters: frames (good frames), dropped (frames lost according to the
+    # sequence numbers), partial (frames cut short or corrupted, caught by
+    # the checksum), skipped (bytes thrown away while resyncing), overflow
+    # (bytes lost because the ring was full).
+    def __init__(self, size=256, chunk=64):
+        # size has to be a power of two
+        self.ring = bytearray(size)
+        self.mask = size - 1
+        self.head = 0
+        self.tail = 0
+        self.scratch = bytearray(chunk)
+        view = memoryview(self.scratch)
+        self.views = tuple(view[:n] for n in range(chunk + 1))
+        self.frame = bytearray(FRAME_LEN)
+        self.bits = 0
+        self.seq = None
+        self.frames = 0
+        self.dropped = 0
+        self.partial = 0
+        self.skipped = 0
+        self.overflow = 0
+        self.resyncing = False
+
+    def drain(self, uart):
+        ring = self.ring
+        mask = self.mask
+        scratch = self.scratch
+        chunk = len(scratch)
+        n = uart.in_waiting
+        while n:
+            got = uart.readinto(self.views[min(n, chunk)])
+            if not got:
+                break
+            head = self.head
+            for i in range(got):
+                ring[(head + i) & mask] = scratch[i]
+            self.head = head + got
+            lost = self.head - self.tail - len(ring)
+            if lost > 0:
+                self.overflow += lost
+                self.tail += lost
+            n -= got
+
+    def poll(self, uart, on_state=None, on_event=None):
+        self.drain(uart)
+        self.parse(on_state, on_event)
+
+    def parse(self, on_state=None, on_event=None):
+        ring = self.ring
+        mask = self.mask
+        frame = self.frame
+        while self.head - self.tail:
+            tail = self.tail
+            length = frame_len(ring[tail & mask])
+            if not length:
+                self.tail = tail + 1
+                self.skipped += 1
+                continue
+            if self.head - tail < length:
+                break
+            for i in range(length):
+                frame[i] = ring[(tail + i) & mask]
+            if length == FRAME_LEN:
+                value = decode_state(frame)
+            else:
+                value = decode_event(frame)
+            if value is None:
+                if not self.resyncing:
+                    self.partial += 1
+                    self.resyncing = True
+                self.tail = tail + 1
+                self.skipped += 1
+                continue
+            self.resyncing = False
+            self.tail = tail + length
+
+            seq = frame[0] & SEQ_MASK
+            if self.seq is not None:
+                self.dropped += (seq - self.seq - 1) & SEQ_MASK
+            self.seq = seq
+            self.frames += 1
+
+            if length == FRAME_LEN:
+                self.bits = value
+                if on_state is not None:
+                    on_state(value)
+            else:
+                idx = value & ~PRESS
+                if value & PRESS:
+                    self.bits |= 1 << idx
+                else:
+                    self.bits &= ~(1 << idx)
+                if on_event is not None:
+                    on_event(idx, value & PRESS != 0)
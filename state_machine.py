@@ -2,6 +2,11 @@ import time
 
 verbose = False
 
+# Times passed to update()/into() are integer nanoseconds from a clock sampled
+# once per scan (time.monotonic_ns() on the board), so they don't lose
+# precision with uptime the way float seconds do.
+NS_PER_S = 1000000000
+
 
 class StartState:
     def __init__(self, name, next_state):
@@ -14,10 +19,10 @@ class StartState:
     def type(self):
         return "start"
 
-    def into(self, smap, permissive_hold=False):
+    def into(self, smap, now, permissive_hold=False):
         return self
 
-    def update(self, key_state, smap, permissive_hold=False):
+    def update(self, key_state, smap, now, permissive_hold=False):
         if key_state == False:
             return self
         else:
@@ -54,11 +59,11 @@ class KeyPressState:
     def reset(self):
         self.is_pressed = False
 
-    def into(self, smap, permissive_hold=False):
+    def into(self, smap, now, permissive_hold=False):
         self.reset()
-        return self.update(True, smap)
+        return self.update(True, smap, now)
 
-    def update(self, inp, smap, permissive_hold=False):
+    def update(self, inp, smap, now, permissive_hold=False):
         if inp and not self.is_pressed:
             self.is_pressed = True
             try:
@@ -81,7 +86,7 @@ class KeyPressState:
                 self.is_pressed = False
             except OSError:
                 print("os error?")
-                self.update(inp, smap, permissive_hold)
+                self.update(inp, smap, now, permissive_hold)
             return smap[self.next_state]
 
 
@@ -95,8 +100,15 @@ class KeySequenceState:
         self.kc = kc_list
         self.release_without_kc = release_without_kc
         self.delay = delay
+        self.player = None
+        self.macro = None  # MacroPlayer handle of the last play
         self.reset()
 
+    def bind_macros(self, player):
+        # with a MacroPlayer the steps go out over the next scans instead of
+        # blocking here
+        self.player = player
+
     def release(self):
         for kc in self.kc:
             if isinstance(kc, list):
@@ -110,13 +122,22 @@ class KeySequenceState:
     def reset(self):
         self.is_pressed = False
 
-    def into(self, smap, permissive_hold=False):
+    def into(self, smap, now, permissive_hold=False):
         self.reset()
-        return self.update(True, smap)
+        return self.update(True, smap, now)
 
-    def update(self, inp, smap, permissive_hold=False):
+    def update(self, inp, smap, now, permissive_hold=False):
         if inp and not self.is_pressed:
             self.is_pressed = True
+            if self.player is not None:
+                # pressed again before its macro finished: stop it instead
+                if self.macro is not None and self.player.cancel(self.macro):
+                    self.macro = None
+                    return self
+                self.macro = self.player.play(
+                    self.kb, self.kc, int(self.delay * NS_PER_S)
+                )
+                return self
             try:
                 for kc in self.kc:
                     if isinstance(kc, list):
@@ -136,70 +157,20 @@ class KeySequenceState:
         elif not inp and not self.is_pressed:
             return self
         else:
+            if self.player is not None:
+                # every step releases its own keys, and the macro may still be
+                # playing
+                self.is_pressed = False
+                return smap[self.next_state]
             try:
                 self.release()
                 self.is_pressed = False
             except OSError:
                 print("os error?")
-                self.update(inp, smap, permissive_hold)
+                self.update(inp, smap, now, permissive_hold)
             return smap[self.next_state]
 
 
-class MouseMoveState:
-    def __init__(self, name, mouse, dx, dy, next_state, dw=0, ax=1, ay=1):
-        self.name = name
-        self.next_state = next_state
-        self.mouse = mouse
-        self.dx = dx
-        self.dy = dy
-        self.dw = dw
-        self.ax = ax
-        self.ay = ay
-        self.vx = self.vy = self.vw = 0
-        self.is_pressed = False
-        self.reset()
-
-    def release(self):
-        pass
-
-    def type(self):
-        return "mousemove"
-
-    def reset(self):
-        self.vx = self.vy = self.vw = 0
-
-    def into(self, smap, permissive_hold=False):
-        self.reset()
-        return self.update(True, smap)
-
-    def update(self, inp, smap, permissive_hold=False):
-        if inp and not self.is_pressed:
-            self.is_pressed = True
-            self.vx = self.dx
-            self.vy = self.dy
-            self.vw = self.dw
-            retval = self
-        elif inp and self.is_pressed:
-            self.vx *= self.ax
-            self.vy *= self.ay
-            self.vw *= 1
-            retval = self
-        elif not inp and not self.is_pressed:
-            retval = self
-        else:
-            self.is_pressed = False
-            self.reset()
-            retval = smap[self.next_state]
-
-        if self.is_pressed:
-            try:
-                self.mouse.move(int(self.vx), int(self.vy), int(self.vw))
-            except OSError:
-                print("usb error?")
-
-        return retval
-
-
 class KeyTapState:
     def __init__(self, name, kb, kc, next_state):
         self.name = name
@@ -217,11 +188,11 @@ class KeyTapState:
     def type(self):
         return "keytap"
 
-    def into(self, smap, permissive_hold=False):
+    def into(self, smap, now, permissive_hold=False):
         self.reset()
-        return self.update(True, smap)
+        return self.update(True, smap, now)
 
-    def update(self, inp, smap, permissive_hold=False):
+    def update(self, inp, smap, now, permissive_hold=False):
         if not self.is_list:
             self.kb.press(self.kc)
             self.kb.release(self.kc)
@@ -242,49 +213,70 @@ class WaitState:
         success_on_permissive_hold=False,
     ):
         self.name = name
-        self.T = T
+        self.T = int(T * NS_PER_S)
         self.success_state = success_state
         self.fail_state = fail_state
         self.inverted = inverted
         self.success_on_permissive_hold = success_on_permissive_hold
+        self.timers = None
+        self.parked = False
         self.reset()
 
+    def bind_timers(self, timers, side, bit):
+        # with a timer service the scan loop leaves this state alone while it
+        # waits (parked) and ticks it again when the deadline is due
+        self.timers = timers
+        self.side = side
+        self.bit = bit
+
     def reset(self):
+        if self.parked:
+            self.timers.cancel(self.side, self.bit)
+            self.parked = False
         self.wait_started = None
         self.in_wait = None
 
+    def leave(self, next_state):
+        if self.parked:
+            self.timers.cancel(self.side, self.bit)
+            self.parked = False
+        return next_state
+
     def type(self):
         return "wait"
 
-    def into(self, smap, permissive_hold=False):
+    def into(self, smap, now, permissive_hold=False):
         self.reset()
-        return self.update(True, smap, permissive_hold)
+        return self.update(True, smap, now, permissive_hold)
 
-    def update(self, inp, smap, permissive_hold=False):
+    def update(self, inp, smap, now, permissive_hold=False):
         if self.inverted:
             inp = not inp
 
         if inp and self.success_on_permissive_hold and permissive_hold:
             if verbose:
                 print(f"permissive hold {self.name} transitioning to success")
-            return smap[self.success_state]
+            return self.leave(smap[self.success_state])
 
         if inp and not self.in_wait:
             self.in_wait = True
-            self.wait_started = time.monotonic()
+            self.wait_started = now
+            if self.timers is not None:
+                self.timers.schedule(now + self.T + 1, self.side, self.bit)
+                self.parked = True
             return self
         elif inp and self.in_wait:
-            if time.monotonic() - self.wait_started > self.T:
+            if now - self.wait_started > self.T:
                 # print(f"{self.name} transitioning to success")
-                return smap[self.success_state]
+                return self.leave(smap[self.success_state])
             return self
         elif not inp and self.in_wait:
-            if time.monotonic() - self.wait_started > self.T:
+            if now - self.wait_started > self.T:
                 # print(f"{self.name} transitioning to success")
-                return smap[self.success_state]
+                return self.leave(smap[self.success_state])
             else:
                 # print(f"{self.name} transitioning to failure")
-                return smap[self.fail_state]
+                return self.leave(smap[self.fail_state])
         else:
             # print("wait else?")
             return self
@@ -294,18 +286,34 @@ class StateMachine:
     def __init__(self, states):
         self.states = states
         self.reset()
-        self.cur_state = states["start"]
+        self.start = states["start"]
+        self.cur_state = self.start
+        self.parked = False
 
     def reset(self):
         for s in self.states.values():
             s.reset()
 
+    def bind_timers(self, timers, side, bit):
+        for s in self.states.values():
+            if hasattr(s, "bind_timers"):
+                s.bind_timers(timers, side, bit)
+
+    def bind_macros(self, player):
+        for s in self.states.values():
+            if hasattr(s, "bind_macros"):
+                s.bind_macros(player)
+
     @property
     def cur_state_type(self):
         return self.cur_state.type()
 
-    def update(self, inp, permissive_hold=False):
-        next_state = self.cur_state.update(inp, self.states, permissive_hold)
+    @property
+    def idle(self):
+        return self.cur_state is self.start
+
+    def update(self, inp, now, permissive_hold=False):
+        next_state = self.cur_state.update(inp, self.states, now, permissive_hold)
 
         while next_state != self.cur_state:
             if verbose:
@@ -313,7 +321,7 @@ class StateMachine:
                 print(f"State changed to {str(next_state)}")
             if next_state:
                 self.cur_state = next_state
-                next_state = next_state.into(self.states, permissive_hold)
+                next_state = next_state.into(self.states, now, permissive_hold)
             else:
                 break
         self.cur_state = next_state
@@ -321,3 +329,4 @@ class StateMachine:
             # print("machine died, rebooting")
             self.reset()
             self.cur_state = self.states[0]
+        self.parked = getattr(self.cur_state, "parked", False)
@@ -0,0 +1,125 @@
+from array import array
+
+# Per-stage scan timing. Each stage gets a fixed histogram of power-of-two
+# microsecond buckets (bucket i counts times under 2**(i+1) us that didn't
+# fit the bucket before, the last one everything longer), plus the max. The
+# whole loop is tracked the same way along with overruns of a target scan
+# period. The scan loop laps every stage exactly once per scan, so all the
+# histograms count the same scans, and only when stats are enabled.
+
+UART = 0
+DECODE = 1
+SCAN = 2
+LAYER = 3
+HOLD = 4
+DISPATCH = 5
+TICK = 6
+HID = 7
+GC = 8
+STAGE_NAMES = (
+    "uart",
+    "left decode",
+    "right scan",
+    "layer",
+    "tap-hold",
+    "dispatch",
+    "macro/mouse",
+    "hid send",
+    "gc",
+)
+N_BUCKETS = 16
+
+
+def bucket(ns):
+    us = ns // 1000
+    i = 0
+    while us > 1 and i < N_BUCKETS - 1:
+        us >>= 1
+        i += 1
+    return i
+
+
+class Histogram:
+    def __init__(self):
+        self.counts = array("L", [0] * N_BUCKETS)
+        self.max = 0
+        self.total = 0
+
+    def record(self, ns):
+        self.counts[bucket(ns)] += 1
+        self.total += 1
+        if ns > self.max:
+            self.max = ns
+
+    def percentile(self, fraction):
+        # upper bound in us of the bucket holding the given fraction
+        target = self.total * fraction
+        seen = 0
+        for i in range(N_BUCKETS):
+            seen += self.counts[i]
+            if seen >= target:
+                return 1 << (i + 1)
+        return 1 << N_BUCKETS
+
+    def reset(self):
+        for i in range(N_BUCKETS):
+            self.counts[i] = 0
+        self.max = 0
+        self.total = 0
+
+
+class ScanStats:
+    def __init__(self, clock, target_period_ms=2):
+        self.clock = clock  # monotonic_ns
+        self.target = int(target_period_ms * 1000000)
+        self.stages = tuple(Histogram() for _ in STAGE_NAMES)
+        self.loop = Histogram()
+        self.overruns = 0
+        self.started = 0
+        self.mark = 0
+
+    def start(self, now):
+        self.started = self.mark = now
+
+    def lap(self, stage):
+        now = self.clock()
+        self.stages[stage].record(now - self.mark)
+        self.mark = now
+
+    def end(self):
+        took = self.mark - self.started
+        self.loop.record(took)
+        if took > self.target:
+            self.overruns += 1
+
+    def reset(self):
+        for hist in self.stages:
+            hist.reset()
+        self.loop.reset()
+        self.overruns = 0
+
+    def dump(self):
+        print("stage        p50us  p99us  max_us  buckets (<2us, <4us, <8us, ...)")
+        for name, hist in zip(STAGE_NAMES, self.stages):
+            print(
+                "%-11s %6d %6d %7d  %s"
+                % (
+                    name,
+                    hist.percentile(0.5),
+                    hist.percentile(0.99),
+                    hist.max // 1000,
+                    list(hist.counts),
+                )
+            )
+        loop = self.loop
+        print(
+            "loop        %6d %6d %7d  overruns %d/%d over %dus"
+            % (
+                loop.percentile(0.5),
+                loop.percentile(0.99),
+                loop.max // 1000,
+                self.overruns,
+                loop.total,
+                self.target // 1000,
+            )
+        )
@@ -0,0 +1,71 @@
+from keytrace import LEFT, DOWN
+
+# Tap-hold resolution. While any tap-hold key (a machine parked in a
+# WaitState) is undecided, the scan loop doesn't hand other keys' edges to
+# their machines; they queue here in the order they happened, coded like
+# keytrace entries (LEFT | DOWN | key index). Once every tap-hold has gone
+# one way or the other the queue is replayed, so whatever the other keys
+# send reaches the host after the tap or the hold, never before. Keys that go
+# down in the same scan as a tap-hold queue behind it too, except under
+# hold_on_other_key_press, where they go out with its hold.
+#
+# What decides an undecided key early, besides its own release (tap) and
+# its timeout (hold):
+#
+#   hold_on_other_key_press  hold as soon as another key goes down
+#   permissive_hold          hold once another key goes down and up again
+#                            while it's held, tap if it's released first
+#   timeout                  nothing, only T decides
+#
+# A tap-hold that waits on its key coming back (TapDance's second tap) ends
+# on any other key press whatever the policy. With retro_tap, a key that
+# went to hold on its timeout and is released without another key pressed
+# in the meantime sends its tap as well.
+
+POLICIES = ("hold_on_other_key_press", "permissive_hold", "timeout")
+
+
+class TapHoldResolver:
+    def __init__(self, n_keys, policy="hold_on_other_key_press", retro_tap=False):
+        if policy not in POLICIES:
+            raise ValueError(f"unknown tap-hold policy {policy}")
+        self.policy = policy
+        self.retro_tap = retro_tap
+        self.events = []  # queued edges, oldest first
+        self.bit_index = {1 << idx: idx for idx in range(n_keys)}
+        self.retro = -1  # LEFT | key index of the key that may retro tap
+
+    def push(self, side, pressed, released):
+        # queue one scan's edges of a half
+        code = LEFT if side == "left" else 0
+        bit_index = self.bit_index
+        events = self.events
+        while released:
+            bit = released & -released
+            released ^= bit
+            events.append(code | bit_index[bit])
+        if pressed:
+            self.retro = -1
+        while pressed:
+            bit = pressed & -pressed
+            pressed ^= bit
+            events.append(code | DOWN | bit_index[bit])
+
+    def wants_hold(self, key, inverted):
+        # whether the undecided tap-hold `key` (LEFT | key index) should be
+        # made to decide now, going by the queued edges
+        events = self.events
+        hold_on_press = inverted or self.policy == "hold_on_other_key_press"
+        permissive = self.policy == "permissive_hold"
+        for i in range(len(events)):
+            code = events[i]
+            if not code & DOWN or code & ~DOWN == key:
+                continue
+            if hold_on_press:
+                return True
+            if permissive:
+                up = code & ~DOWN
+                for j in range(i + 1, len(events)):
+                    if events[j] == up:
+                        return True
+        return False
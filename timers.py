@@ -0,0 +1,32 @@
+# Deadline queue for the timing states. A waiting state schedules the time
+# it should be looked at again, keyed by the (side, key bit) it belongs to,
+# and the scan loop only ticks it once that deadline has passed (or its key
+# changes) instead of polling it every scan.
+
+
+class Timers:
+    def __init__(self):
+        self.queue = []  # [deadline, side, bit], soonest first
+
+    def schedule(self, deadline, side, bit):
+        self.cancel(side, bit)
+        queue = self.queue
+        i = 0
+        while i < len(queue) and queue[i][0] <= deadline:
+            i += 1
+        queue.insert(i, [deadline, side, bit])
+
+    def cancel(self, side, bit):
+        queue = self.queue
+        for i in range(len(queue)):
+            entry = queue[i]
+            if entry[2] == bit and entry[1] == side:
+                del queue[i]
+                return
+
+    def expire(self, now, due):
+        # ors the bits of every key whose deadline has passed into due[side]
+        queue = self.queue
+        while queue and queue[0][0] <= now:
+            _, side, bit = queue.pop(0)
+            due[side] |= bit